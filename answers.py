@@ -0,0 +1,43 @@
+from templates import Template
+from watcher import WatchedFile
+
+
+class Answers:
+    """Compiled answers.json with lookup tables indexed by state"""
+
+    def __init__(self, raw: dict, version: int):
+        """
+        :param raw: parsed answers.json
+        :param version: integer that increases every time answers.json is reloaded
+        """
+        self.version = version
+        self.states: dict = raw
+        self.default: dict = raw['*']
+        self.keyboard_commands: dict = {  # {state: {button_text: command}}
+            state: {button['text']: button['command'] for button in messages.get('#KeyboardButtons', [])}
+            for state, messages in raw.items()
+        }
+        self._templates = {}  # {string: Template}, compiled on first use (new snapshot after reload starts empty)
+
+    def state(self, state: str) -> dict:
+        """:return all messages of state (or of '*' state if state is unknown)"""
+        return self.states.get(state, self.default)
+
+    def template(self, text: str) -> Template:
+        """:return text compiled into Template (every text is compiled once per answers.json version)"""
+        template = self._templates.get(text)
+        if template is None:
+            template = self._templates[text] = Template(text)
+        return template
+
+    def has_buttons(self, state: str, button_type: str) -> bool:
+        """:return True if state has button_type ('#KeyboardButtons' or '#InlineButtons') buttons"""
+        return self.state(state).get(button_type) is not None
+
+
+answers_file = WatchedFile('answers.json', Answers)
+
+
+def get_answers() -> Answers:
+    """Returns current compiled answers.json (reloaded automatically when file changes)"""
+    return answers_file.get()
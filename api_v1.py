@@ -1,35 +1,130 @@
+import asyncio
 import datetime
 import os
+import time
 import logging
 
+import aiohttp
 import dotenv
-import requests
 
-from models import User, UserInfo, Dialog, Discussion, Team, Suggestion
+import metrics
+from cache import AsyncCache
+from config import get_config
+from models import User, UserInfo, Dialog, Discussion, Team, Suggestion, Outbox
 
 
 dotenv.load_dotenv(dotenv.find_dotenv())
 SERVER = os.getenv('SERVER')
 API_KEY = os.getenv('API_KEY')
 
+__session: aiohttp.ClientSession = None
+__semaphore: asyncio.Semaphore = None
+__cache = AsyncCache(ttl=0)
 
-def get(link: str, json: dict = None, params: dict = None):
-    logging.info(f"GET {SERVER}/api/v1{link}")
-    return requests.get(f"{SERVER}/api/v1{link}", params=params, json=json, headers={'Authorization': f"Bearer {API_KEY}"}).json()
+CACHE_INVALIDATIONS = {  # {link of request that changes data: link of cached reply that becomes outdated}
+    '/team': '/teams'
+}
 
 
-def post(link: str, json: dict = None, params: dict = None):
-    logging.info(f"POST {SERVER}/api/v1{link}")
-    return requests.post(f"{SERVER}/api/v1{link}", params=params, json=json, headers={'Authorization': f"Bearer {API_KEY}"}).json()
+class ApiUnavailable(Exception):
+    """Raised when AXIOM server can't be reached, doesn't reply in time or replies with server error"""
 
 
-def patch(link: str, json: dict = None, params: dict = None):
-    logging.info(f"PATCH {SERVER}/api/v1{link}")
-    return requests.patch(f"{SERVER}/api/v1{link}", params=params, json=json, headers={'Authorization': f"Bearer {API_KEY}"}).json()
+def get_session() -> aiohttp.ClientSession:
+    """Returns shared ClientSession (keep-alive connections are reused by all requests)"""
+    global __session, __semaphore
 
+    if (__session is None) or __session.closed:
+        config = get_config()
+        __session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=config.api_max_connections),
+            timeout=aiohttp.ClientTimeout(total=config.api_timeout),
+            headers={'Authorization': f"Bearer {API_KEY}"}
+        )
+        __semaphore = asyncio.Semaphore(config.api_max_requests)
+    return __session
 
-def add_user(user: User, edit: bool = False) -> dict:
-    user_info: UserInfo = UserInfo.get(user.id)
+
+async def close_session():
+    """Closes shared ClientSession and all its connections"""
+    global __session
+
+    if (__session is not None) and (not __session.closed):
+        await __session.close()
+    __session = None
+
+
+async def request(method: str, link: str, json: dict = None, params: dict = None) -> dict:
+    """
+    Sends request to AXIOM server
+    :return: parsed json reply
+    :raise ApiUnavailable: when server can't be reached, doesn't reply in time or replies with 5xx status
+    """
+    logging.info("%s %s/api/v1%s", method, SERVER, link)
+    session = get_session()
+    labels = {'method': method, 'link': metrics.link_template(link)}
+    started = time.monotonic()
+    try:
+        async with __semaphore:  # limits amount of concurrent requests
+            try:
+                async with session.request(method, f"{SERVER}/api/v1{link}", params=params, json=json) as response:
+                    if response.status >= 500:
+                        raise ApiUnavailable(f"{method} {link} : server replied with status {response.status}")
+                    return await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                raise ApiUnavailable(f"{method} {link} : {error.__class__.__name__} {error}") from error
+    except ApiUnavailable:
+        metrics.api_errors.inc(**labels)
+        raise
+    finally:
+        metrics.api_seconds.observe(time.monotonic() - started, **labels)
+
+
+async def safe_request(method: str, link: str, json: dict = None, params: dict = None) -> dict:
+    """Same as request(), but server problems are returned as unsuccessful reply"""
+    try:
+        return await request(method, link, json=json, params=params)
+    except ApiUnavailable as error:
+        logging.error(str(error))
+        return {'success': False, 'data': None, 'error': {'message': 'AXIOM server is unavailable'}}
+
+
+async def get(link: str, json: dict = None, params: dict = None):
+    return await safe_request('GET', link, json=json, params=params)
+
+
+async def cached_get(link: str, params: dict = None) -> dict:
+    """
+    Same as get(), but successful replies are cached for config.json -> api_cache_ttl seconds
+    (cached replies are shared, so they MUST NOT be changed)
+    """
+    config = get_config()
+    __cache.ttl, __cache.stale_ttl = config.api_cache_ttl, config.api_cache_stale_ttl
+    key = (link, tuple(sorted((params or {}).items())))
+    return await __cache.get(key, lambda: get(link, params=params), cacheable=lambda reply: reply.get('success'))
+
+
+def invalidate_cache(link: str):
+    """Forgets cached replies of link (with any params)"""
+    __cache.invalidate(lambda key: key[0] == link)
+
+
+def invalidate_after(link: str):
+    """Forgets cached replies that became outdated after request to link was delivered"""
+    if link in CACHE_INVALIDATIONS:
+        invalidate_cache(CACHE_INVALIDATIONS[link])
+
+
+async def post(link: str, json: dict = None, params: dict = None):
+    return await safe_request('POST', link, json=json, params=params)
+
+
+async def patch(link: str, json: dict = None, params: dict = None):
+    return await safe_request('PATCH', link, json=json, params=params)
+
+
+async def add_user(user: User, edit: bool = False) -> dict:
+    user_info: UserInfo = await UserInfo.aio.get(user.id)
     json = {
         'firstName': user_info.name,
         'lastName': user_info.surname,
@@ -39,33 +134,34 @@ def add_user(user: User, edit: bool = False) -> dict:
     }
     if user_info.patronymic is not None:
         json['middleName'] = user_info.patronymic
-    return post("/user", json=json) if (not edit) else patch(f"/user/tg-id/{user.id}", json=json)
+    return (await post("/user", json=json)) if (not edit) else (await patch(f"/user/tg-id/{user.id}", json=json))
 
 
-def login_user(login: str, password: str) -> dict:
+async def login_user(login: str, password: str) -> dict:
     json = {
         'axiomId': login,
         'password': password
     }
-    return get("/ЧТО-ТО", json=json)
+    return await get("/ЧТО-ТО", json=json)
 
 
-def get_user(user: User) -> dict:
-    return get(f'/user/tg-id/{user.id}')
+async def get_user(user: User) -> dict:
+    return await get(f'/user/tg-id/{user.id}')
 
 
-def get_user_by_axiom_id(axiom_id: str) -> dict:
-    return get(f'/user/{axiom_id}')
+async def get_user_by_axiom_id(axiom_id: str) -> dict:
+    return await get(f'/user/{axiom_id}')
 
 
-def add_discussion(discussion: Discussion) -> dict:
+async def add_discussion(discussion: Discussion) -> dict:
     json = {
         'topicByLabel': discussion.theme
     }
-    return post(f'/user/tg-id/{discussion.user_id}/dialog', json=json)
+    return await post(f'/user/tg-id/{discussion.user_id}/dialog', json=json)
 
 
-def add_dialog(who: int, discussion_id: int, text: str, time: datetime, moderator: int = None) -> dict:
+async def add_dialog(who: int, discussion_id: int, text: str, time: datetime, moderator: int = None):
+    """Adds message to discussion on server (through outbox)"""
     json = {
         'text': text,
         'timestamp': int(round(time.timestamp() * 1000))
@@ -73,34 +169,37 @@ def add_dialog(who: int, discussion_id: int, text: str, time: datetime, moderato
     }
     if moderator is not None:
         json['fromModerator'] = moderator
-    return post(f'/user/tg-id/{who}/dialog/{discussion_id}/add-message', json=json)
+    await Outbox.aio.add(f'discussion:{discussion_id}', 'POST', f'/user/tg-id/{who}/dialog/{discussion_id}/add-message', json=json)
 
 
-def close_discussion(who: int, discussion_id: int) -> dict:
-    return post(f'/user/tg-id/{who}/dialog/{discussion_id}/resolve')
+async def close_discussion(who: int, discussion_id: int):
+    """Closes discussion on server (through outbox)"""
+    await Outbox.aio.add(f'discussion:{discussion_id}', 'POST', f'/user/tg-id/{who}/dialog/{discussion_id}/resolve')
 
 
-def add_suggestion(suggestion: Suggestion):
+async def add_suggestion(suggestion: Suggestion):
+    """Sends suggestion to server (through outbox)"""
     json = {
         'timestamp': int(round(suggestion.time.timestamp() * 1000)),
         'message': suggestion.text,
         'topicByLabel': suggestion.theme
     }
-    return post(f'/user/tg-id/{suggestion.user_id}/feedback', json=json)
+    await Outbox.aio.add(f'suggestion:{suggestion.id}', 'POST', f'/user/tg-id/{suggestion.user_id}/feedback', json=json)
 
 
-def get_competitions() -> dict:
-    return get('/competitions')
+async def get_competitions() -> dict:
+    return await cached_get('/competitions')
 
 
-def get_teams(competition_id: int) -> dict:
+async def get_teams(competition_id: int) -> dict:
     json = {
         'competitionId': competition_id
     }
-    return get('/teams', params=json)
+    return await cached_get('/teams', params=json)
 
 
-def add_team(team: Team):
+async def add_team(team: Team):
+    """Sends team to server (through outbox)"""
     params = {
         'telegramId': team.owner_id
     }
@@ -109,13 +208,5 @@ def add_team(team: Team):
         'chatId': team.chat_id,
         'competitionId': team.competition_id
     }
-    res = post('/team', params=params, json=json)
-
-    return res  # TODO add chat_id
-
-    if not res['success']:
-        return res
-    json = {
-        'chatId': team.chat_id
-    }
-    return post(f'/team/{res["data"]["id"]}/assign-chat', json=json)
+    await Outbox.aio.add(f'team:{team.chat_id}', 'POST', '/team', params=params, json=json)  # TODO assign chat_id after team is created
+    invalidate_after('/team')
@@ -0,0 +1,613 @@
+"""
+Micro-benchmarks of hot paths: reply and keyboard lookups from bot_functions.py/keyboards.py
+and every lookup of models.py against SQLite database with 1k, 100k and 1M dialogs.
+Scaling scenario runs indexed lookups without their indexes (as before) and with them, and prints how they grow with database.
+Concurrency scenarios run many updates at once: with blocking model calls (before async layer) and with Model.aio,
+and with blocking requests to slow stub AXIOM server (before api_v1 session) and with pooled, cached api_v1.
+
+python benchmark.py --save benchmark_baseline.json      # new baseline
+python benchmark.py --compare benchmark_baseline.json   # fails if something became slower than --threshold
+"""
+import argparse
+import asyncio
+import contextlib
+import http.server
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import urllib.request
+from datetime import datetime, timedelta
+
+
+DEFAULT_SIZES = (1_000, 100_000, 1_000_000)  # amounts of dialogs in database
+SEED_CHUNK = 20_000  # amount of rows inserted at once
+LOOKUP_KEYS = 1_000  # amount of random keys every model lookup cycles through
+CONCURRENT_UPDATES = 500  # amount of updates in concurrency scenarios
+ARRIVAL_INTERVAL = 0.01  # amount of seconds between arrivals of updates in concurrency scenarios (100 updates per second)
+NETWORK_TIME = 0.005  # amount of seconds every update waits for Telegram in concurrency scenarios
+TICK = 0.001  # interval of ticker that measures how long event loop was blocked
+API_UPDATES = 100  # amount of updates in slow API scenario (blocking requests are slow to run)
+DEFAULT_API_LATENCIES = (0.01, 0.05)  # amounts of seconds stub AXIOM server waits before reply
+SCALING_VARIANTS = ('no_index', 'index')  # variants of scaling scenario in order before -> after
+
+
+class Benchmark:
+    """Measures seconds per call of functions"""
+
+    def __init__(self, min_time: float, repeat: int, pattern: str = None):
+        """
+        :param min_time: min amount of seconds one measurement takes (amount of calls is picked to fit it)
+        :param repeat: amount of measurements, the best one is taken
+        :param pattern: only cases which names contain pattern are measured
+        """
+        self.min_time = min_time
+        self.repeat = repeat
+        self.pattern = pattern
+        self.results = {}  # {case: seconds per call}
+
+    def measure(self, case: str, function, *keys):
+        """
+        Measures function, that is called with next key on every call (without arguments if there are no keys)
+        :param case: name of case like 'models.User.get[1000]'
+        """
+        if not self.wants(case):
+            return
+        if keys:
+            keys = itertools.cycle(keys)
+            call = lambda: function(next(keys))  # noqa: E731
+        else:
+            call = function
+
+        timer = timeit.Timer(call)
+        number, elapsed = timer.autorange()
+        while elapsed < self.min_time:
+            number *= 2
+            elapsed = timer.timeit(number)
+        best = min([elapsed] + timer.repeat(self.repeat - 1, number)) / number
+        self.record(case, best)
+
+    def record(self, case: str, seconds: float):
+        """Saves result that was measured without Benchmark.measure (like latency of concurrent updates)"""
+        self.results[case] = seconds
+        print(f'{case:<60} {format_time(seconds):>12}', flush=True)
+
+    def wants(self, case: str) -> bool:
+        """:return True if case matches pattern"""
+        return (self.pattern is None) or (self.pattern in case)
+
+
+def format_time(seconds: float) -> str:
+    if seconds < 1e-3:
+        return f'{seconds * 1e6:.2f} us'
+    return f'{seconds * 1e3:.3f} ms'
+
+
+def benchmark_bot_functions(benchmark: Benchmark):
+    from aiogram.types import Message
+
+    from bot_functions import get_reply, button_to_command, is_unknown_reply
+    from keyboards import get_markup, fill_user_info
+    from models import UserInfo
+
+    benchmark.measure('bot_functions.get_reply[plain]', lambda: get_reply('register1', 'Иванов'))
+    benchmark.measure('bot_functions.get_reply[link]', lambda: get_reply('registered', '/ask'))
+    benchmark.measure('bot_functions.get_reply[link_chain]', lambda: get_reply('edit_menu', '/surname'))
+    benchmark.measure('bot_functions.get_reply[template]', lambda: get_reply('register5', 'Инженер'))
+    benchmark.measure('bot_functions.get_reply[callback]', lambda: get_reply('user_questions', callback=True))
+    benchmark.measure('bot_functions.get_reply[restricted]', lambda: get_reply('registered', '#Banned'))
+    benchmark.measure('bot_functions.get_reply[inline_buttons]', lambda: get_reply('registered', '/edit', inline_buttons=True))
+    benchmark.measure('bot_functions.is_unknown_reply', lambda: is_unknown_reply('register5', 'Садовник'))
+
+    message = Message(text='')
+    for case, text in [('button', 'Наш канал'), ('text', 'Просто текст')]:
+        def press(text=text):
+            message.text = text  # button_to_command changes text of message
+            button_to_command('registered', message)
+        benchmark.measure(f'bot_functions.button_to_command[{case}]', press)
+
+    benchmark.measure('keyboards.get_markup[keyboard_buttons]', lambda: get_markup('registered', '*'))
+    benchmark.measure('keyboards.get_markup[inline_buttons]', lambda: get_markup('registered', '/edit'))
+    benchmark.measure('keyboards.get_markup[no_buttons]', lambda: get_markup('register1', 'Иванов'))
+    benchmark.measure('keyboards.get_markup[skip]', lambda: get_markup('register5', 'Инженер', skip=('Инженер',)))
+    buttons = get_reply('registered', '/edit', inline_buttons=True)
+    benchmark.measure('keyboards.get_markup[parsed_buttons]', lambda: get_markup(buttons=buttons, buttons_type='#InlineButtons'))
+
+    user_info = UserInfo(user_id=1, name='Иван', surname='Иванов', patronymic=None, email='ivan@example.com', job='Инженер;Программист')
+    edit_keyboard = get_markup('registered', '/edit')
+    plain_keyboard = get_markup('question_menu', '/my_questions')
+    benchmark.measure('keyboards.fill_user_info[placeholders]', lambda: fill_user_info(edit_keyboard, user_info))
+    benchmark.measure('keyboards.fill_user_info[no_placeholders]', lambda: fill_user_info(plain_keyboard, user_info))
+
+
+class Seeder:
+    """Fills database proportionally to amount of dialogs (grow() adds rows to data that is already there)"""
+
+    FIRST_USER_ID = 100_000_000
+    FIRST_CHAT_ID = -1_000_000_000_000
+    DIALOGS_PER_DISCUSSION = 4  # question, answer, question, answer
+    COMPETITIONS = 5
+
+    def __init__(self, seed: int = 0):
+        self.random = random.Random(seed)
+        self.started = datetime(2022, 1, 1)
+        self.users = self.teams = self.discussions = self.suggestions = self.applications = self.outbox = self.timers = 0
+
+    def grow(self, dialogs: int):
+        """Adds rows until database has `dialogs` dialogs (and proportional amount of other rows)"""
+        import models
+        from database import create_session
+
+        users, teams = max(dialogs // 10, 100), max(dialogs // 1000, 10)
+        with contextlib.closing(create_session()) as session:
+            self._insert(session, models.User, ({'id': self.user_id(number), 'state': 'registered'} for number in range(self.users, users)))
+            self._insert(session, models.UserInfo, (
+                {'user_id': self.user_id(number), 'name': 'Иван', 'surname': 'Иванов', 'email': f'user{number}@example.com', 'job': 'Инженер'}
+                for number in range(self.users, users)
+            ))
+            self.users = users
+
+            self._insert(session, models.Team, (
+                {'chat_id': self.chat_id(number), 'owner_id': self.random_user(), 'competition_id': number % self.COMPETITIONS + 1,
+                 'title': f'Team {number}', 'description': None if number % 10 == 0 else 'Description'}
+                for number in range(self.teams, teams)
+            ))
+            self._insert(session, models.Member, (
+                {'chat_id': self.chat_id(number), 'user_id': self.random_user()} for number in range(self.teams, teams) for member in range(5)
+            ))
+            self.teams = teams
+
+            applications = dialogs // 100
+            self._insert(session, models.Application, (
+                {'user_id': self.random_user(), 'chat_id': self.random_chat(), 'poll_id': number, 'accepted': self.random.choice([None, True, False])}
+                for number in range(self.applications, applications)
+            ))
+            self.applications = applications
+
+            discussions = dialogs // self.DIALOGS_PER_DISCUSSION
+            for first in range(self.discussions, discussions, SEED_CHUNK):
+                numbers = range(first, min(first + SEED_CHUNK, discussions))
+                self._insert(session, models.Discussion, (self.discussion_row(number) for number in numbers))
+                self._insert(session, models.Dialog, (row for number in numbers for row in self.dialog_rows(number)))
+            self.discussions = max(self.discussions, discussions)
+
+            suggestions = dialogs // 10
+            self._insert(session, models.Suggestion, (
+                {'id': number + 1, 'user_id': self.random_user(), 'time': self.time(number), 'theme': 'Другое', 'text': f'Suggestion {number}'}
+                for number in range(self.suggestions, suggestions)
+            ))
+            self.suggestions = suggestions
+
+            outbox = timers = dialogs // 1000 + 10
+            now = datetime.now()
+            self._insert(session, models.Outbox, (
+                {'key': f'discussion:{number}', 'method': 'POST', 'link': f'/user/tg-id/{self.random_user()}/dialog/{number}/resolve',
+                 'time': now, 'attempts': 0, 'next_attempt': now + timedelta(seconds=self.random.randint(-3600, 3600))}
+                for number in range(self.outbox, outbox)
+            ))
+            self._insert(session, models.Timer, (
+                {'kind': 'close_discussion', 'key': str(number), 'deadline': now + timedelta(seconds=self.random.randint(-3600, 172800)), 'payload': '{}'}
+                for number in range(self.timers, timers)
+            ))
+            self.outbox, self.timers = outbox, timers
+            session.commit()
+
+    def discussion_row(self, number: int) -> dict:
+        last_dialog = self.dialog_id(number, self.DIALOGS_PER_DISCUSSION - 1)
+        return {
+            'id': number + 1, 'server_id': number + 1, 'user_id': self.random_user(), 'theme': 'Соревнования',
+            'finished': self.random.random() < 0.7, 'last_message_at': self.time(last_dialog),
+            'last_question_id': last_dialog - 1, 'message_count': self.DIALOGS_PER_DISCUSSION
+        }
+
+    def dialog_rows(self, number: int) -> list:
+        rows = []
+        for index in range(self.DIALOGS_PER_DISCUSSION):
+            dialog_id = self.dialog_id(number, index)
+            rows.append({
+                'id': dialog_id, 'discussion_id': number + 1, 'server_id': number + 1, 'text': f'Message {dialog_id}',
+                'who': self.FIRST_USER_ID, 'time': self.time(dialog_id), 'message_id': dialog_id, 'bot_message_id': dialog_id,
+                'moderator': index % 2 == 1
+            })
+        return rows
+
+    def dialog_id(self, discussion_number: int, index: int) -> int:
+        return discussion_number * self.DIALOGS_PER_DISCUSSION + index + 1
+
+    def time(self, number: int) -> datetime:
+        return self.started + timedelta(seconds=number)
+
+    def user_id(self, number: int) -> int:
+        return self.FIRST_USER_ID + number
+
+    def chat_id(self, number: int) -> int:
+        return self.FIRST_CHAT_ID - number
+
+    def random_user(self) -> int:
+        return self.user_id(self.random.randrange(self.users or 1))
+
+    def random_chat(self) -> int:
+        return self.chat_id(self.random.randrange(self.teams or 1))
+
+    @staticmethod
+    def _insert(session, model, rows):
+        """Inserts rows by chunks of SEED_CHUNK"""
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, SEED_CHUNK))
+            if not chunk:
+                return
+            session.execute(model.__table__.insert(), chunk)
+
+
+def benchmark_models(benchmark: Benchmark, seeder: Seeder, size: int):
+    import models
+
+    def sample(count: int, key) -> list:
+        """:return LOOKUP_KEYS random keys (key(number) for number in range(count))"""
+        return [key(seeder.random.randrange(count)) for _ in range(LOOKUP_KEYS)]
+
+    users = sample(seeder.users, seeder.user_id)
+    chats = sample(seeder.teams, seeder.chat_id)
+    discussion_ids = sample(seeder.discussions, lambda number: number + 1)
+    dialog_ids = sample(seeder.discussions * seeder.DIALOGS_PER_DISCUSSION, lambda number: number + 1)
+    discussions = [models.Discussion.get(discussion_id) for discussion_id in discussion_ids[:100]]
+    teams = [models.Team.get(chat_id) for chat_id in chats[:100]]
+    competition_chats = {
+        competition: [seeder.chat_id(number) for number in range(seeder.teams) if number % seeder.COMPETITIONS + 1 == competition]
+        for competition in range(1, seeder.COMPETITIONS + 1)
+    }
+    broadcasts = [
+        models.Broadcast(id=0, competition_id=competition, last_user_id=user_id, text='')
+        for competition, user_id in zip(itertools.cycle([None, 1, 2]), users[:99])
+    ]
+
+    cases = [
+        ('User.get', models.User.get, users),
+        ('User.read_state', models.User.read_state, users),
+        ('UserInfo.get', models.UserInfo.get, users),
+        ('Discussion.get', models.Discussion.get, discussion_ids),
+        ('Discussion.get_discussions', models.Discussion.get_discussions, users),
+        ('Discussion.update', models.Discussion.update, discussions),
+        ('Discussion.get_last_message', models.Discussion.get_last_message, discussions),
+        ('Discussion.get_last_question', models.Discussion.get_last_question, discussions),
+        ('Discussion.get_questions', models.Discussion.get_questions, discussions),
+        ('Dialog.get', models.Dialog.get, dialog_ids),
+        ('Dialog.get_question', models.Dialog.get_question, dialog_ids),
+        ('Suggestion.get', models.Suggestion.get, sample(seeder.suggestions, lambda number: number + 1)),
+        ('Suggestion.get_suggestions', models.Suggestion.get_suggestions, users),
+        ('Team.get', models.Team.get, chats),
+        ('Team.get_members', models.Team.get_members, chats),
+        ('Team.user_in_team', lambda key: key[0].user_in_team(key[1]), list(zip(teams, users))),
+        ('Team.get_joinable_chats', lambda key: models.Team.get_joinable_chats(key[0], competition_chats[key[1]]), [(user_id, user_id % seeder.COMPETITIONS + 1) for user_id in users]),
+        ('Team.get_all_chats', lambda key: models.Team.get_all_chats(), [None]),
+        ('Team.get_all_user_chats', models.Team.get_all_user_chats, users),
+        ('Team.get_current_user_chats', models.Team.get_current_user_chats, users),
+        ('Application.get', lambda key: models.Application.get(*key), list(zip(users, chats))),
+        ('Outbox.get_due', lambda key: models.Outbox.get_due(50), [None]),
+        ('Outbox.depth', lambda key: models.Outbox.depth(), [None]),
+        ('Outbox.oldest_time', lambda key: models.Outbox.oldest_time(), [None]),
+        ('Timer.get_due', lambda key: models.Timer.get_due(50), [None]),
+        ('Timer.get_deadlines', lambda key: models.Timer.get_deadlines(), [None]),
+        ('Broadcast.get_recipients', lambda broadcast: broadcast.get_recipients(100), broadcasts),
+        ('Broadcast.get_unfinished', lambda key: models.Broadcast.get_unfinished(), [None]),
+    ]
+    for case, function, keys in cases:
+        benchmark.measure(f'models.{case}[{size}]', function, *keys)
+
+
+def benchmark_scaling(benchmark: Benchmark, seeder: Seeder, size: int):
+    """
+    Lookups that have own index: without the index (as before, index is dropped) and with it (index is created again
+    by database.create_missing_indexes, like on start of bot). Team.get is served by unique teams.chat_id in both variants
+    """
+    import database
+    import models
+
+    def sample(count: int, key) -> list:
+        return [key(seeder.random.randrange(count)) for _ in range(LOOKUP_KEYS)]
+
+    users = sample(seeder.users, seeder.user_id)
+    chats = sample(seeder.teams, seeder.chat_id)
+    teams = [models.Team.get(chat_id) for chat_id in chats[:100]]
+    cases = [  # (case, function, keys, index that is dropped)
+        ('Dialog.get_question', models.Dialog.get_question, sample(seeder.discussions * seeder.DIALOGS_PER_DISCUSSION, lambda number: number + 1), 'ix_dialogs_bot_message_id'),
+        ('Discussion.get_discussions', models.Discussion.get_discussions, users, 'ix_discussions_user_id_finished'),
+        ('Team.get_members', models.Team.get_members, chats, 'ix_members_chat_id_user_id'),
+        ('Team.user_in_team', lambda key: key[0].user_in_team(key[1]), list(zip(teams, users)), 'ix_members_chat_id_user_id'),
+        ('Application.get', lambda key: models.Application.get(*key), list(zip(users, chats)), 'ix_applications_user_id_chat_id'),
+        ('Team.get', models.Team.get, chats, None),
+    ]
+    cases = [case for case in cases if any(benchmark.wants(f'scaling.{case[0]}[{variant},{size}]') for variant in SCALING_VARIANTS)]
+    if not cases:
+        return
+    indexes = {index.name: index for table in database.SqlAlchemyBase.metadata.sorted_tables for index in table.indexes}
+    with contextlib.closing(database.create_session()) as session:
+        engine = session.get_bind()
+
+    for index in {index for case, function, keys, index in cases if index is not None}:
+        indexes[index].drop(engine)
+    try:
+        for case, function, keys, index in cases:
+            benchmark.measure(f'scaling.{case}[no_index,{size}]', function, *keys)
+    finally:
+        database.create_missing_indexes(engine)
+    for case, function, keys, index in cases:
+        benchmark.measure(f'scaling.{case}[index,{size}]', function, *keys)
+
+
+def print_scaling(benchmark: Benchmark, sizes: list):
+    """Prints time of every scaling case at every size and how many times it grew from the smallest to the biggest size"""
+    cases = sorted({case.split('[')[0] for case in benchmark.results if case.startswith('scaling.')})
+    if not cases or len(sizes) < 2:
+        return
+    print(f"\n{'case':<40} {'variant':<9}" + ''.join(f' {size:>12}' for size in sizes) + f" {'growth':>8}")
+    for case in cases:
+        for variant in SCALING_VARIANTS:
+            times = [benchmark.results.get(f'{case}[{variant},{size}]') for size in sizes]
+            if None in times:
+                continue
+            print(f'{case:<40} {variant:<9}' + ''.join(f' {format_time(seconds):>12}' for seconds in times) + f' {times[-1] / times[0]:>7.1f}x')
+
+
+async def run_concurrently(handle, keys: list, interval: float) -> dict:
+    """
+    Handles keys like updates that arrive every `interval` seconds (without waiting for previous ones),
+    while ticker measures how long event loop is blocked
+    :param handle: async function(key) that handles one update
+    :return: {'per_update': seconds of run / amount of updates, 'p50' and 'p99': seconds from arrival to end of update,
+              'loop_lag': max seconds ticker was late}
+    """
+    latencies = []
+    lag = 0.0
+    running = True
+
+    async def tick():
+        nonlocal lag
+        while running:
+            started = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lag = max(lag, time.perf_counter() - started - TICK)
+
+    async def update(number: int, key):
+        arrival = started + number * interval
+        await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+        await handle(key)
+        latencies.append(time.perf_counter() - arrival)  # includes time update waited for blocked event loop
+
+    ticker = asyncio.get_event_loop().create_task(tick())
+    started = time.perf_counter()
+    await asyncio.gather(*(update(number, key) for number, key in enumerate(keys)))
+    elapsed = time.perf_counter() - started
+    running = False
+    await ticker
+
+    latencies.sort()
+    return {
+        'per_update': elapsed / len(keys),
+        'p50': latencies[len(latencies) // 2],
+        'p99': latencies[min(len(latencies) - 1, round(0.99 * len(latencies)))],
+        'loop_lag': lag
+    }
+
+
+def record_variants(benchmark: Benchmark, name: str, label: str, results: dict):
+    """
+    Records results of run_concurrently for every variant and prints how the last variant differs from the first one
+    :param name: name of scenario like 'concurrency.database'
+    :param label: size or setting of run like '1000'
+    :param results: {variant: results of run_concurrently} in order before -> after
+    """
+    for variant, values in results.items():
+        for metric, seconds in values.items():
+            benchmark.record(f'{name}.{metric}[{variant},{label}]', seconds)
+    (before, old), (after, new) = list(results.items())[0], list(results.items())[-1]
+    print(f'{name}[{label}] {after} vs {before}: ' + ', '.join(
+        f'{metric} {new[metric] / old[metric] - 1:+.0%}' if old[metric] else f'{metric} {format_time(new[metric])}' for metric in old
+    ), flush=True)
+
+
+def benchmark_concurrent_database(benchmark: Benchmark, seeder: Seeder, size: int, connection_string: str):
+    """
+    Updates that read user and discussions, change user and reply to Telegram, arriving every ARRIVAL_INTERVAL:
+    blocking model calls on event loop (as before async layer) and the same calls through Model.aio
+    """
+    import database
+    import models
+
+    name = 'concurrency.database'
+    if not benchmark.wants(f'{name}.'):
+        return
+    users = [seeder.random_user() for _ in range(CONCURRENT_UPDATES)]
+
+    async def blocking(user_id: int):
+        user = models.User.get(user_id)
+        models.Discussion.get_discussions(user_id)
+        user.set(state='registered')
+        await asyncio.sleep(NETWORK_TIME)
+
+    async def non_blocking(user_id: int):
+        user = await models.User.aio.get(user_id)
+        await models.Discussion.aio.get_discussions(user_id)
+        await user.aio.set(state='registered')
+        await asyncio.sleep(NETWORK_TIME)
+
+    async def scenario() -> dict:
+        results = {'sync': await run_concurrently(blocking, users, ARRIVAL_INTERVAL)}
+        if database.global_init_async(connection_string):
+            results['async'] = await run_concurrently(non_blocking, users, ARRIVAL_INTERVAL)
+            await database.global_close_async()  # connections belong to event loop of this scenario
+        else:
+            print('Async driver is not installed, only blocking calls are measured')
+        return results
+
+    record_variants(benchmark, name, str(size), asyncio.run(scenario()))
+
+
+class StubApiServer(http.server.ThreadingHTTPServer):
+    """AXIOM server that replies successfully after `latency` seconds (in its own thread, so blocking clients work too)"""
+
+    daemon_threads = True
+    request_queue_size = 128  # concurrent connects must not wait for retransmit of SYN
+
+    def __init__(self, latency: float):
+        super().__init__(('127.0.0.1', 0), StubApiHandler)
+        self.latency = latency
+        self.requests = 0
+        self.url = f'http://127.0.0.1:{self.server_address[1]}'
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class StubApiHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive connections
+
+    def do_GET(self):
+        self.server.requests += 1
+        time.sleep(self.server.latency)
+        body = json.dumps({'success': True, 'data': []}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def benchmark_slow_api(benchmark: Benchmark, latency: float):
+    """
+    Updates that read competitions, teams of competition and user from AXIOM server (like join menu), arriving every ARRIVAL_INTERVAL:
+    blocking request with new connection per call (as before api_v1 session) and api_v1 with pooled connections,
+    capped concurrent requests and cached competitions and teams
+    """
+    import api_v1
+
+    name = 'concurrency.api'
+    if not benchmark.wants(f'{name}.'):
+        return
+    users = list(range(1, API_UPDATES + 1))
+
+    with StubApiServer(latency) as server:
+        def blocking_get(link: str) -> dict:
+            with urllib.request.urlopen(f'{server.url}/api/v1{link}') as response:
+                return json.loads(response.read())
+
+        async def blocking(user_id: int):
+            blocking_get('/competitions')
+            blocking_get('/teams?competitionId=1')
+            blocking_get(f'/user/tg-id/{user_id}')
+
+        async def pooled(user_id: int):
+            await api_v1.get_competitions()
+            await api_v1.get_teams(1)
+            await api_v1.get(f'/user/tg-id/{user_id}')
+
+        async def scenario() -> dict:
+            results = {}
+            for variant, handle in [('blocking', blocking), ('pooled', pooled)]:
+                api_v1.SERVER = server.url
+                api_v1.invalidate_cache('/competitions')
+                api_v1.invalidate_cache('/teams')
+                server.requests = 0
+                results[variant] = await run_concurrently(handle, users, ARRIVAL_INTERVAL)
+                print(f'{name}[{variant},{latency * 1000:.0f}ms]: {server.requests} requests to server', flush=True)
+            await api_v1.close_session()  # connections belong to event loop of this scenario
+            return results
+
+        record_variants(benchmark, name, f'{latency * 1000:.0f}ms', asyncio.run(scenario()))
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Prints results next to baseline
+    :param threshold: allowed slowdown (0.25 means 25 % slower)
+    :return [case, ...] that are slower than baseline more than threshold
+    """
+    regressions = []
+    print(f"\n{'case':<60} {'baseline':>12} {'current':>12} {'change':>8}")
+    for case, seconds in results.items():
+        if case not in baseline:
+            print(f'{case:<60} {"-":>12} {format_time(seconds):>12}      new')
+            continue
+        change = seconds / baseline[case] - 1
+        mark = ''
+        if change > threshold:
+            regressions.append(case)
+            mark = '  REGRESSION'
+        elif change < -threshold:
+            mark = '  faster'
+        print(f'{case:<60} {format_time(baseline[case]):>12} {format_time(seconds):>12} {change:>+8.1%}{mark}')
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of bot_functions.py, keyboards.py and models.py')
+    parser.add_argument('--sizes', type=int, nargs='*', default=list(DEFAULT_SIZES), help='amounts of dialogs in database (ascending)')
+    parser.add_argument('--api-latencies', type=float, nargs='*', default=list(DEFAULT_API_LATENCIES), help='amounts of seconds stub AXIOM server waits before reply')
+    parser.add_argument('--filter', help='only cases which names contain this string')
+    parser.add_argument('--min-time', type=float, default=0.2, help='min amount of seconds one measurement takes')
+    parser.add_argument('--repeat', type=int, default=5, help='amount of measurements of every case (the best is taken)')
+    parser.add_argument('--save', help='file to write results to (use it to make new baseline)')
+    parser.add_argument('--compare', help='baseline file to compare results with')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown compared to baseline (0.25 is 25 %%)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING)  # before bot modules are imported, so reply lookups don't write bot.log
+    benchmark = Benchmark(args.min_time, args.repeat, args.filter)
+
+    with tempfile.TemporaryDirectory(prefix='axiom_benchmark_') as directory:
+        import database
+        connection_string = f"sqlite:///{os.path.join(directory, 'benchmark.db')}"
+        database.global_init(connection_string)
+
+        benchmark_bot_functions(benchmark)
+        for latency in args.api_latencies:
+            benchmark_slow_api(benchmark, latency)
+        seeder = Seeder()
+        for size in sorted(args.sizes):
+            print(f'Seeding database with {size} dialogs', flush=True)
+            seeder.grow(size)
+            benchmark_models(benchmark, seeder, size)
+            benchmark_scaling(benchmark, seeder, size)
+            benchmark_concurrent_database(benchmark, seeder, size, connection_string)
+        print_scaling(benchmark, sorted(args.sizes))
+
+    results = {
+        'python': platform.python_version(),
+        'machine': f'{platform.system()} {platform.machine()}',
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'results': {case: round(seconds, 9) for case, seconds in benchmark.results.items()}
+    }
+    if args.save is not None:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)['results']
+        regressions = compare(benchmark.results, baseline, args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} cases are slower than baseline by more than {args.threshold:.0%}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,14 @@
 import logging
-import json
+import copy
 
 from aiogram.types import Message
 
+from answers import get_answers
+from config import get_config
+
+
+logger = logging.getLogger(__name__)  # reply lookups are made several times per update, see config.json -> logging_levels
+
 
 def get_reply(state: str, text: str = "", callback: bool = False, keyboard_buttons: bool = False, inline_buttons: bool = False, safe: bool = True) -> dict or list:
     """
@@ -10,21 +16,19 @@ def get_reply(state: str, text: str = "", callback: bool = False, keyboard_butto
     - reply dictionary from answers.json when keyboard_buttons and inline_buttons is None
     - list of buttons from answers.json when one of parameters keyboard_buttons and inline_buttons is not None
     """
-    with open('answers.json', 'r', encoding='UTF-8') as file:
-        logging.info(f'Get reply for state={state}, message={text}, callback={callback}, keyboard_buttons={keyboard_buttons}, inline_buttons={inline_buttons}')
-        answers = json.load(file)
-        state_messages = answers.get(state, answers['*'])
-        if callback:
-            return parse_link(state_messages['#'], state)
-        if safe:
-            text = '*' if (text in get_config()['restricted_messages']) else text
-        reply: dict = state_messages.get(text, state_messages['*'])
-        if keyboard_buttons:
-            return get_raw_button(reply['next'], '#KeyboardButtons')
-        if inline_buttons:
-            return get_raw_button(reply['next'], '#InlineButtons')
-
-        return parse_link(reply, state)
+    logger.debug('Get reply for state=%s, message=%s, callback=%s, keyboard_buttons=%s, inline_buttons=%s', state, text, callback, keyboard_buttons, inline_buttons)
+    state_messages = get_answers().state(state)
+    if callback:
+        return parse_link(copy.copy(state_messages['#']), state)
+    if safe:
+        text = '*' if (text in get_config().restricted_messages) else text
+    reply: dict = state_messages.get(text, state_messages['*'])
+    if keyboard_buttons:
+        return get_raw_button(reply['next'], '#KeyboardButtons')
+    if inline_buttons:
+        return get_raw_button(reply['next'], '#InlineButtons')
+
+    return parse_link(copy.copy(reply), state)  # copy, so callers can't change compiled answers
 
 
 def get_raw_button(state: str, button_type: str) -> list:
@@ -45,49 +49,43 @@ def parse_link(reply: dict or list, state: str) -> dict or list:
 
 def button_to_command(state: str, message: Message):
     """Changes message is message_text is on Keyboard buttons"""
-    with open('answers.json', 'r', encoding='UTF-8') as file:
-        logging.info(f'Get KeyboardButton state for user_state={state}, button_text={message.text}')
-        answers = json.load(file)
-        for button in answers.get(state, answers['*']).get('#KeyboardButtons', {}):
-            if button['text'] == message.text:
-                message.text = button['command']
+    logger.debug('Get KeyboardButton state for user_state=%s, button_text=%s', state, message.text)
+    answers = get_answers()
+    commands = answers.keyboard_commands.get(state, answers.keyboard_commands['*'])
+    if message.text in commands:
+        message.text = commands[message.text]
 
 
-def is_unknown_reply(state: str, text: str) -> bool:
-    """Returns True is user_message is leading to '*' state"""
-    with open('answers.json', 'r', encoding='UTF-8') as file:
-        answers = json.load(file)
-        state_messages = answers.get(state, answers['*'])
-        reply = state_messages.get(text, None)
-        return (reply is None) or (text in get_config()['restricted_messages'])
+def render(text: str, values: dict, parse_mode: str = None) -> str:
+    """
+    Replaces %placeholders% of answers.json string with values in one pass
+    :param values: {placeholder name: value}, templates.Markup values are not escaped
+    :param parse_mode: parse_mode of message (None, 'HTML' or 'MarkdownV2') values are escaped for
+    """
+    return get_answers().template(text).render(values, parse_mode)
 
 
-def get_config() -> dict:
-    """Returns config.json file as dict()"""
-    with open('config.json', 'r', encoding='UTF-8') as file:
-        return json.load(file)
+def is_unknown_reply(state: str, text: str) -> bool:
+    """Returns True is user_message is leading to '*' state"""
+    reply = get_answers().state(state).get(text, None)
+    return (reply is None) or (text in get_config().restricted_messages)
 
 
 def has_keyboard_buttons(state: str, text: str, safe: bool = True) -> bool:
     """Returns True is next User.state has keyboard buttons"""
-    with open('answers.json', 'r', encoding='UTF-8') as file:
-        answers = json.load(file)
-        state_messages = answers.get(state, answers['*'])
-        if safe:
-            text = '*' if text in get_config()['restricted_messages'] else text
-        reply = state_messages.get(text, state_messages['*'])
-        next_state_messages = answers.get(reply['next'], answers['*'])
-        return next_state_messages.get('#KeyboardButtons') is not None
+    answers = get_answers()
+    state_messages = answers.state(state)
+    if safe:
+        text = '*' if text in get_config().restricted_messages else text
+    reply = state_messages.get(text, state_messages['*'])
+    return answers.has_buttons(reply['next'], '#KeyboardButtons')
 
 
 def has_inline_buttons(state: str, text: str, safe: bool = True) -> bool:
     """Returns True is next User.state has inline buttons"""
-    with open('answers.json', 'r', encoding='UTF-8') as file:
-        answers = json.load(file)
-        state_messages = answers.get(state, answers['*'])
-        if safe:
-            text = '*' if text in get_config()['restricted_messages'] else text
-        reply = state_messages.get(text, state_messages['*'])
-        next_state_messages = answers.get(reply['next'], answers['*'])
-        return next_state_messages.get('#InlineButtons') is not None
-
+    answers = get_answers()
+    state_messages = answers.state(state)
+    if safe:
+        text = '*' if text in get_config().restricted_messages else text
+    reply = state_messages.get(text, state_messages['*'])
+    return answers.has_buttons(reply['next'], '#InlineButtons')
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.utils.exceptions import TelegramAPIError, BotBlocked, UserDeactivated, ChatNotFound
+
+import send_queue
+from config import get_config
+from database import UnitOfWork
+from models import Broadcast
+
+
+class Broadcaster:
+    """
+    Sends message to all registered users (or to members of competition teams).
+    Recipients are read from database in chunks, progress is saved after every chunk,
+    so broadcasts interrupted by restart are resumed by Broadcaster.start
+    """
+
+    def __init__(self, bot: Bot, chunk_size: int = 100, workers: int = 10):
+        """
+        :param bot: bot that sends messages (its send queue keeps Telegram rate limits)
+        :param chunk_size: amount of recipients read from database at once (and sent between two checkpoints)
+        :param workers: amount of messages that are sent at the same time
+        """
+        self.bot = bot
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self._tasks = set()  # running asyncio.Task
+        self._running = set()  # ids of broadcasts that are being sent
+
+    async def start(self):
+        """Resumes interrupted broadcasts"""
+        for broadcast in await Broadcast.aio.get_unfinished():
+            if broadcast.id not in self._running:
+                logging.info('Resume %s', broadcast)
+                self._start(self.run(broadcast))
+
+    async def stop(self):
+        """Stops broadcasts (they are resumed from the last checkpoint by Broadcaster.start)"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def broadcast(self, text: str, competition_id: int = None):
+        """
+        Starts new broadcast in background
+        :param text: string that represents message for recipients
+        :param competition_id: integer (or None for all registered users) that represents competition id
+        """
+        self._start(self._add_and_run(text, competition_id))
+
+    async def run(self, broadcast: Broadcast):
+        """Sends broadcast to recipients after broadcast.last_user_id and reports result to admin_chat"""
+        UnitOfWork.detach()  # progress must be saved right away, not with update that started broadcast
+        send_queue.set_priority(send_queue.BULK_PRIORITY)  # replies to users are sent first
+        started, sent_before = time.monotonic(), broadcast.sent
+
+        self._running.add(broadcast.id)
+        try:
+            while True:
+                recipients = await broadcast.aio.get_recipients(self.chunk_size)
+                if not recipients:
+                    break
+                results = await self.send_chunk(broadcast.text, recipients)
+                await broadcast.aio.checkpoint(
+                    recipients[-1],
+                    broadcast.sent + results.count('sent'),
+                    broadcast.failed + results.count('failed'),
+                    broadcast.blocked + results.count('blocked')
+                )
+            await broadcast.aio.checkpoint(broadcast.last_user_id, broadcast.sent, broadcast.failed, broadcast.blocked, finished=True)
+        finally:
+            self._running.discard(broadcast.id)
+
+        speed = (broadcast.sent - sent_before) / max(time.monotonic() - started, 0.001)
+        logging.info('%s finished, %.1f messages per second', broadcast, speed)
+        await self.report(
+            f'Рассылка #{broadcast.id} завершена\n'
+            f'Отправлено: {broadcast.sent}\n'
+            f'Заблокировали бота: {broadcast.blocked}\n'
+            f'Ошибок: {broadcast.failed}\n'
+            f'Скорость: {speed:.1f} сообщений/сек'
+        )
+
+    async def send_chunk(self, text: str, recipients: list) -> list:
+        """
+        Sends text to recipients (self.workers messages at the same time)
+        :return: ['sent' or 'blocked' or 'failed', ...] result for every recipient
+        """
+        semaphore = asyncio.Semaphore(self.workers)
+
+        async def send(user_id: int) -> str:
+            async with semaphore:
+                try:
+                    await self.bot.send_message(user_id, text)
+                except (BotBlocked, UserDeactivated, ChatNotFound):
+                    return 'blocked'
+                except TelegramAPIError as error:
+                    logging.warning('Broadcast to %s failed: %s', user_id, error)
+                    return 'failed'
+                return 'sent'
+
+        return await asyncio.gather(*(send(user_id) for user_id in recipients))
+
+    async def report(self, text: str):
+        """Sends text to admin_chat"""
+        try:
+            await self.bot.send_message(get_config().admin_chat, text)
+        except TelegramAPIError:
+            logging.exception('Broadcast report was not sent')
+
+    async def _add_and_run(self, text: str, competition_id: int or None):
+        UnitOfWork.detach()
+        broadcast = await Broadcast.aio.add(text, competition_id)
+        await self.report(f'Рассылка #{broadcast.id} начата')
+        await self.run(broadcast)
+
+    def _start(self, coroutine):
+        task = asyncio.get_event_loop().create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if (not task.cancelled()) and (task.exception() is not None):
+            logging.error('Broadcast failed', exc_info=task.exception())
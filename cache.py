@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import time
+
+
+class AsyncCache:
+    """
+    Cache for results of async functions.
+    Fresh values (younger than ttl) are returned as is, stale values (younger than ttl + stale_ttl) are returned
+    while they are refreshed in background, older values are fetched again.
+    Concurrent fetches of the same key share one call
+    """
+
+    def __init__(self, ttl: float, stale_ttl: float = 0.0):
+        """
+        :param ttl: amount of seconds value is fresh
+        :param stale_ttl: amount of seconds after ttl when stale value can be returned
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0  # amount of values returned from cache (fresh or stale)
+        self.misses = 0  # amount of values that were waited for
+        self._values = {}  # {key: (value, fetch time)}
+        self._fetches = {}  # {key: asyncio.Task} of fetches that are not finished yet
+        self._generation = 0  # increases on every invalidation, so fetches started before it are not saved
+
+    async def get(self, key, fetch, cacheable=None):
+        """
+        :param key: hashable key of value
+        :param fetch: async function without arguments that returns value
+        :param cacheable: function(value) -> bool, values that are not cacheable are returned but not saved
+        :return: value from cache or from fetch()
+        """
+        if key in self._values:
+            value, fetched = self._values[key]
+            age = time.monotonic() - fetched
+            if age < self.ttl:
+                self.hits += 1
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self.hits += 1
+                self._fetch(key, fetch, cacheable)  # refresh in background
+                return value
+
+        self.misses += 1
+        return await asyncio.shield(self._fetch(key, fetch, cacheable))
+
+    def invalidate(self, match=None):
+        """
+        Forgets values (fetches that are running now won't be saved)
+        :param match: function(key) -> bool that selects keys to forget, all keys are forgotten if None
+        """
+        for key in [key for key in self._values if (match is None) or match(key)]:
+            del self._values[key]
+        for key in [key for key in self._fetches if (match is None) or match(key)]:
+            del self._fetches[key]
+        self._generation += 1
+
+    def _fetch(self, key, fetch, cacheable) -> asyncio.Task:
+        """Starts fetch of key (or returns fetch that is already running)"""
+        task = self._fetches.get(key)
+        if task is None:
+            task = self._fetches[key] = asyncio.get_event_loop().create_task(self._run_fetch(key, fetch, cacheable))
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())  # background refresh errors are already logged
+        return task
+
+    async def _run_fetch(self, key, fetch, cacheable):
+        generation = self._generation
+        try:
+            value = await fetch()
+        except Exception:
+            logging.exception('Fetch of %s failed', key)
+            raise
+        finally:
+            if self._fetches.get(key) is asyncio.current_task():
+                del self._fetches[key]
+
+        if (generation == self._generation) and ((cacheable is None) or cacheable(value)):
+            self._values[key] = (value, time.monotonic())
+        return value
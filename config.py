@@ -0,0 +1,104 @@
+from dataclasses import dataclass
+
+from watcher import WatchedFile
+
+
+@dataclass(frozen=True)
+class Config:
+    """Immutable snapshot of config.json (see README for description of each variable)"""
+    version: int
+    waiting_time: int
+    poll_life_time: int
+    moderator_chat: int
+    admin_chat: int
+    suggestions_limit: int
+    logging_file: str
+    logging_level: str
+    logging_levels: tuple
+    logging_sampling: tuple
+    logging_max_bytes: int
+    logging_rotation_interval: float
+    logging_backup_count: int
+    restricted_messages: frozenset
+    bot_admin_access: tuple
+    server_error_messages: bool
+    api_timeout: float
+    api_max_connections: int
+    api_max_requests: int
+    api_cache_ttl: float
+    api_cache_stale_ttl: float
+    telegram_global_rate: float
+    telegram_private_rate: float
+    telegram_group_rate: float
+    max_concurrent_updates: int
+    webhook_path: str
+    webapp_host: str
+    webapp_port: int
+    webhook_max_connections: int
+    webhook_certificate: str
+    webhook_private_key: str
+    database_pool_size: int
+    database_max_overflow: int
+    state_storage: str
+    state_storage_capacity: int
+    state_flush_interval: float
+    metrics_host: str
+    metrics_port: int
+    fan_out_limit: int
+
+    @staticmethod
+    def from_json(raw: dict, version: int):
+        """
+        Builds Config from parsed config.json
+        :param raw: parsed config.json
+        :param version: integer that increases every time config.json is reloaded
+        """
+        return Config(
+            version=version,
+            waiting_time=int(raw['waiting_time']),
+            poll_life_time=int(raw['poll_life_time']),
+            moderator_chat=int(raw['moderator_chat']),
+            admin_chat=int(raw['admin_chat']),
+            suggestions_limit=int(raw['suggestions_limit']),
+            logging_file=raw['logging_file'],
+            logging_level=raw.get('logging_level', 'INFO').upper(),
+            logging_levels=tuple((name, level.upper()) for name, level in raw.get('logging_levels', {}).items()),
+            logging_sampling=tuple((name, int(rate)) for name, rate in raw.get('logging_sampling', {}).items()),
+            logging_max_bytes=int(raw.get('logging_max_bytes', 10485760)),
+            logging_rotation_interval=float(raw.get('logging_rotation_interval', 86400)),
+            logging_backup_count=int(raw.get('logging_backup_count', 7)),
+            restricted_messages=frozenset(raw['restricted_messages']),
+            bot_admin_access=tuple((right, value) for right, value in raw['bot_admin_access']),
+            server_error_messages=bool(raw['server_error_messages']),
+            api_timeout=float(raw.get('api_timeout', 10)),
+            api_max_connections=int(raw.get('api_max_connections', 20)),
+            api_max_requests=int(raw.get('api_max_requests', 50)),
+            api_cache_ttl=float(raw.get('api_cache_ttl', 60)),
+            api_cache_stale_ttl=float(raw.get('api_cache_stale_ttl', 300)),
+            telegram_global_rate=float(raw.get('telegram_global_rate', 30)),
+            telegram_private_rate=float(raw.get('telegram_private_rate', 1)),
+            telegram_group_rate=float(raw.get('telegram_group_rate', 20)),
+            max_concurrent_updates=int(raw.get('max_concurrent_updates', 100)),
+            webhook_path=raw.get('webhook_path', '/webhook'),
+            webapp_host=raw.get('webapp_host', '127.0.0.1'),
+            webapp_port=int(raw.get('webapp_port', 8080)),
+            webhook_max_connections=int(raw.get('webhook_max_connections', 40)),
+            webhook_certificate=raw.get('webhook_certificate', ''),
+            webhook_private_key=raw.get('webhook_private_key', ''),
+            database_pool_size=int(raw.get('database_pool_size', 5)),
+            database_max_overflow=int(raw.get('database_max_overflow', 10)),
+            state_storage=raw.get('state_storage', 'sql'),
+            state_storage_capacity=int(raw.get('state_storage_capacity', 10000)),
+            state_flush_interval=float(raw.get('state_flush_interval', 5)),
+            metrics_host=raw.get('metrics_host', '127.0.0.1'),
+            metrics_port=int(raw.get('metrics_port', 9100)),
+            fan_out_limit=int(raw.get('fan_out_limit', 10))
+        )
+
+
+config_file = WatchedFile('config.json', Config.from_json)
+
+
+def get_config() -> Config:
+    """Returns current config.json snapshot (reloaded automatically when file changes)"""
+    return config_file.get()
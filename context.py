@@ -0,0 +1,207 @@
+import sys
+import time
+import asyncio
+import logging
+from contextvars import ContextVar
+
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.types import Message, CallbackQuery, Update
+from aiogram.types.chat_member_updated import ChatMemberUpdated
+
+import metrics
+from database import UnitOfWork
+from models import User, UserInfo
+from router import StateRouter
+
+
+_current_context: ContextVar = ContextVar('update_context', default=None)
+
+
+class UpdateContext:
+    """User data of one update. Every row is read from database only once, when it's needed first time"""
+
+    def __init__(self, user_id: int):
+        """:param user_id: integer that represents user telegram id"""
+        self.user_id = user_id
+        self.reads = 0  # amount of database reads made by this context
+        self._user = None
+        self._user_info = None
+        self._user_loaded = False
+        self._user_info_loaded = False
+
+    @property
+    def user(self) -> User or None:
+        """
+        :return User(**kwargs) of update sender or None if user is not in database
+        (reads users table, so with User.storage user must be loaded by UpdateContext.load_user first)
+        """
+        if not self._user_loaded:
+            self._set_user(User.get(self.user_id))
+        return self._user
+
+    @property
+    def user_info(self) -> UserInfo or None:
+        """:return UserInfo(**kwargs) of update sender or None if user is not in database"""
+        if not self._user_info_loaded:
+            self._set_user_info(UserInfo.get(self.user_id))
+        return self._user_info
+
+    async def load_user(self) -> User or None:
+        """Same as UpdateContext.user, but reading doesn't block event loop"""
+        if not self._user_loaded:
+            self._set_user(await User.aio.get(self.user_id))
+        return self._user
+
+    async def load_user_info(self) -> UserInfo or None:
+        """Same as UpdateContext.user_info, but reading doesn't block event loop"""
+        if not self._user_info_loaded:
+            self._set_user_info(await UserInfo.aio.get(self.user_id))
+        return self._user_info
+
+    def _set_user(self, user: User or None):
+        self._user = user
+        self._user_loaded = True
+        self.reads += 1
+
+    def _set_user_info(self, user_info: UserInfo or None):
+        self._user_info = user_info
+        self._user_info_loaded = True
+        self.reads += 1
+
+    def reload(self):
+        """Forgets loaded rows, so they will be read again (use after adding user to database)"""
+        self._user_loaded = self._user_info_loaded = False
+
+    @staticmethod
+    def start(user_id: int):
+        """Creates new UpdateContext for current update"""
+        context = UpdateContext(user_id)
+        _current_context.set(context)
+        return context
+
+    @staticmethod
+    def current(user_id: int):
+        """Returns UpdateContext of current update (creates new one if there is no context for this user)"""
+        context: UpdateContext = _current_context.get()
+        if (context is None) or (context.user_id != user_id):
+            context = UpdateContext.start(user_id)
+        return context
+
+
+class UpdateContextMiddleware(BaseMiddleware):
+    """
+    Creates UpdateContext for every update and passes it to handlers as `context` argument.
+    User of private chats and callback queries is read before filters are checked
+    """
+
+    async def on_pre_process_message(self, message: Message, data: dict):
+        data['context'] = UpdateContext.start(message.from_user.id)
+        if message.chat.id == message.from_user.id:
+            await data['context'].load_user()
+
+    async def on_pre_process_callback_query(self, callback_query: CallbackQuery, data: dict):
+        data['context'] = UpdateContext.start(callback_query.from_user.id)
+        await data['context'].load_user()
+
+    async def on_pre_process_my_chat_member(self, member: ChatMemberUpdated, data: dict):
+        data['context'] = UpdateContext.start(member.from_user.id)
+        await data['context'].load_user()
+
+
+class UnitOfWorkMiddleware(BaseMiddleware):
+    """
+    Runs every update in one UnitOfWork: all changes made by handlers are committed together after the update
+    or rolled back if handler raised an exception
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.commits = 0  # amount of commits made by all updates
+        self.rollbacks = 0  # amount of updates that were rolled back
+
+    async def on_pre_process_update(self, update: Update, data: dict):
+        data['unit_of_work'] = UnitOfWork.begin()
+
+    async def on_post_process_update(self, update: Update, results: list, data: dict):
+        unit_of_work: UnitOfWork = data['unit_of_work']
+        success = sys.exc_info()[1] is None  # post process is called from `finally`, so exception of handler is visible here
+        await unit_of_work.finish(success)
+        self.commits += unit_of_work.commits
+        if not success:
+            self.rollbacks += 1
+            logging.warning('Update %s failed, %s changes rolled back', update.update_id, unit_of_work.writes)
+        elif unit_of_work.writes:
+            logging.info('Update %s committed %s changes in %s commit', update.update_id, unit_of_work.writes, unit_of_work.commits)
+
+
+class UpdateLimitMiddleware(BaseMiddleware):
+    """Limits amount of updates that are processed at the same time (others wait for their turn)"""
+
+    def __init__(self, limit: int):
+        """:param limit: max amount of updates processed at the same time"""
+        super().__init__()
+        self.limit = limit
+        self._semaphore: asyncio.Semaphore = None
+
+    async def on_pre_process_update(self, update: Update, data: dict):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        await self._semaphore.acquire()
+
+    async def on_post_process_update(self, update: Update, results: list, data: dict):
+        self._semaphore.release()
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Measures time of every handled update, counts failed updates and updates that are being handled (see metrics.py).
+    Metrics are labeled by handler (menu handler for updates passed to menus by StateRouter) and state of user
+    ('group' for group chats, 'new' for users that are not in database)
+    """
+
+    def __init__(self, router: StateRouter = None):
+        """:param router: StateRouter which marked handlers are replaced by menu handlers in labels"""
+        super().__init__()
+        self.router = router
+
+    async def on_process_message(self, message: Message, data: dict):
+        self._start(data, 'group' if message.chat.id != message.from_user.id else None)
+
+    async def on_process_callback_query(self, callback_query: CallbackQuery, data: dict):
+        self._start(data)
+
+    async def on_process_my_chat_member(self, member: ChatMemberUpdated, data: dict):
+        self._start(data)
+
+    async def on_post_process_message(self, message: Message, results: list, data: dict):
+        self._finish(data)
+
+    async def on_post_process_callback_query(self, callback_query: CallbackQuery, results: list, data: dict):
+        self._finish(data)
+
+    async def on_post_process_my_chat_member(self, member: ChatMemberUpdated, results: list, data: dict):
+        self._finish(data)
+
+    def _start(self, data: dict, state: str = None):
+        """Called after filters, right before handler"""
+        if state is None:
+            context: UpdateContext = data.get('context')
+            user = context.user if context is not None else None  # already loaded by UpdateContextMiddleware
+            state = user.state if user is not None else 'new'
+        handler = current_handler.get()
+        if self.router is not None:
+            handler = self.router.real_handler(handler, state)
+        name = getattr(handler, '__name__', str(handler))
+        data['metrics'] = (name, state, time.monotonic())
+        metrics.handlers_in_flight.inc(handler=name, state=state)
+
+    def _finish(self, data: dict):
+        """Called from `finally` of update processing (nothing to do if no handler matched update)"""
+        if 'metrics' not in data:
+            return
+        name, state, started = data.pop('metrics')
+        metrics.handlers_in_flight.dec(handler=name, state=state)
+        metrics.handler_seconds.observe(time.monotonic() - started, handler=name, state=state)
+        if sys.exc_info()[1] is not None:
+            metrics.handler_errors.inc(handler=name, state=state)
@@ -1,13 +1,59 @@
+import time
+import asyncio
+import inspect
 import logging
+import itertools
+import functools
+from contextvars import ContextVar
 
 import sqlalchemy
 import sqlalchemy.orm as orm
 from sqlalchemy.orm import Session
 import sqlalchemy.ext.declarative as dec
 
-SqlAlchemyBase = dec.declarative_base()
+import metrics
+
+
+class AsyncCalls:
+    """
+    Descriptor that gives async version of every model method:
+    `await User.aio.get(user_id)` is the same as `User.get(user_id)`, but it doesn't block event loop
+    """
+
+    def __init__(self, proxy: type = None):
+        """:param proxy: subclass of AsyncProxy with model methods that have own async version"""
+        self.proxy = proxy
+
+    def __get__(self, instance, owner):
+        return (self.proxy or AsyncProxy)(owner if instance is None else instance)
+
+
+class AsyncProxy:
+    """Returns methods of target wrapped with run_async"""
+
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, name: str):
+        return functools.partial(run_async, getattr(self._target, name))
+
+
+class AsyncModel:
+    aio = AsyncCalls()
+
+
+SqlAlchemyBase = dec.declarative_base(cls=AsyncModel)
+
+ASYNC_DRIVERS = {
+    'mysql': 'mysql+aiomysql',
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg'
+}
 
 __factory = None
+__async_factory = None
+_bound_session: ContextVar = ContextVar('bound_session', default=None)
+_unit_of_work: ContextVar = ContextVar('unit_of_work', default=None)
 
 
 def global_init(conn_str: str) -> None:
@@ -17,17 +63,324 @@ def global_init(conn_str: str) -> None:
     if __factory:
         return
 
-    logging.info(f"Connecting to database")
+    logging.info("Connecting to database")
 
     engine = sqlalchemy.create_engine(conn_str, echo=False)
-    __factory = orm.sessionmaker(bind=engine)
+    __factory = orm.sessionmaker(bind=engine, expire_on_commit=False)
 
     import models
 
     SqlAlchemyBase.metadata.create_all(engine)
+    added_columns = create_missing_columns(engine)
+    create_missing_indexes(engine)
+
+    if 'discussions.message_count' in added_columns:
+        models.Discussion.fill_activity()
+
+
+def create_missing_columns(engine) -> list:
+    """
+    Adds columns that were added to models after their tables had been created
+    (new columns must be nullable or have server_default)
+    :return: ['table.column', ...] of added columns
+    """
+    existing = sqlalchemy.inspect(engine)
+    added = []
+    for table in SqlAlchemyBase.metadata.sorted_tables:
+        names = {column['name'] for column in existing.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in names:
+                logging.info("Add column %s to %s", column.name, table.name)
+                with engine.begin() as connection:
+                    connection.execute(sqlalchemy.text(f"ALTER TABLE {table.name} ADD COLUMN {sqlalchemy.schema.CreateColumn(column).compile(dialect=engine.dialect)}"))
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def create_missing_indexes(engine) -> None:
+    """
+    Creates indexes that were added to models after their tables had been created
+    (create_all creates only missing tables, so existing databases are migrated here)
+    """
+    existing = sqlalchemy.inspect(engine)
+    for table in SqlAlchemyBase.metadata.sorted_tables:
+        names = {index['name'] for index in existing.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in names:
+                logging.info("Create index %s on %s", index.name, table.name)
+                index.create(engine)
+
+
+def global_init_async(conn_str: str, pool_size: int = 5, max_overflow: int = 10) -> bool:
+    """
+    Connect async engine (global_init must be called first, it creates tables)
+    :param conn_str: same connection string as for global_init (driver is replaced with async one)
+    :param pool_size: amount of connections that are kept open
+    :param max_overflow: amount of connections that can be opened above pool_size
+    :return: True if async engine is ready, False if sync engine will be used instead
+    """
+    global __async_factory
+
+    if __async_factory:
+        return True
+
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+
+        async_conn_str = async_connection_string(conn_str)
+        pool = {'pool_size': pool_size, 'max_overflow': max_overflow, 'pool_pre_ping': True}
+        if async_conn_str.startswith('sqlite'):  # every model call of UnitOfWork has own session, so file database needs pool too
+            pool = {} if ':memory:' in async_conn_str else {'poolclass': sqlalchemy.pool.AsyncAdaptedQueuePool, 'pool_size': pool_size, 'max_overflow': max_overflow}
+        engine = create_async_engine(async_conn_str, echo=False, **pool)
+    except (ImportError, sqlalchemy.exc.ArgumentError) as error:
+        logging.warning("Async database is unavailable (%s: %s), using sync one", error.__class__.__name__, error)
+        return False
+
+    logging.info("Connecting to async database")
+    __async_factory = orm.sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    return True
+
+
+async def global_close_async() -> None:
+    """Closes connections that are kept open by async engine (called on shutdown)"""
+    if __async_factory:
+        await __async_factory.kw['bind'].dispose()
+
+
+def async_connection_string(conn_str: str) -> str:
+    """Replaces driver in connection string with async one ('mysql://...' -> 'mysql+aiomysql://...')"""
+    scheme, address = conn_str.split('://', 1)
+    dialect = scheme.split('+')[0]
+    return f"{ASYNC_DRIVERS.get(dialect, scheme)}://{address}"
 
 
 def create_session() -> Session:
-    """Creates session with orm.sessionmaker"""
-    global __factory
+    """Creates session with orm.sessionmaker (or returns session of current run_async call / unit of work)"""
+    bound = _bound_session.get()
+    if bound is not None:
+        return bound
+    unit_of_work = _unit_of_work.get()
+    if (unit_of_work is not None) and (__async_factory is None):
+        return BoundSession(unit_of_work.open_session(), unit_of_work, owned=True)
     return __factory()
+
+
+async def run_async(function, *args, **kwargs):
+    """
+    Calls model function (like User.get or user.set) with session of async engine, so event loop is not blocked.
+    Inside UnitOfWork changes of function are written by UnitOfWork.finish, otherwise function gets its own transaction.
+    When async engine is not initialized, function is called as is (with sync engine)
+    """
+    started = time.monotonic()
+    try:
+        unit_of_work = _unit_of_work.get()
+        if unit_of_work is not None:
+            return await unit_of_work.run(function, args, kwargs)
+        if __async_factory is None:
+            return function(*args, **kwargs)
+
+        unit_of_work = UnitOfWork()
+        try:
+            result = await unit_of_work.run(function, args, kwargs)
+        except BaseException:
+            await unit_of_work.finish(success=False)
+            raise
+        await unit_of_work.finish()
+        return result
+    finally:
+        # label is built without touching instance: repr of model reads columns, which fails after failed flush
+        metrics.db_call_seconds.observe(time.monotonic() - started, function=getattr(function, '__qualname__', None) or type(function).__name__)
+
+
+class UnitOfWork:
+    """
+    Collects changes of all model calls of an update and writes them in one short transaction.
+    Every model call gets its own session that is closed right after the call, so no transaction is kept open while
+    handler waits for Telegram or AXIOM. Model methods call session.commit() as usual, but their changes are only
+    remembered (later calls of the update see them) and written in UnitOfWork.finish (or discarded if update failed).
+    Rows that are needed right away (their ids or reads of the update) are inserted by session.flush() in own short
+    transaction, they are deleted again if update fails
+    """
+
+    def __init__(self):
+        self.writes = 0  # amount of session.commit() calls made by model methods
+        self.commits = 0  # amount of real commits
+        self._changed = {}  # {id(model): model} changed or added by model calls, written by UnitOfWork.finish
+        self._statements = []  # [(query, 'update' or 'delete', args, kwargs), ...] bulk statements in order they were made
+        self._inserted = []  # models inserted right away by session.flush()
+        self._lock: asyncio.Lock = None  # changed models can't be attached to sessions of two model calls at once
+        self._token = None
+
+    @staticmethod
+    def begin():
+        """Creates UnitOfWork that is used by all model calls of current update (until UnitOfWork.finish)"""
+        unit_of_work = UnitOfWork()
+        unit_of_work._token = _unit_of_work.set(unit_of_work)
+        return unit_of_work
+
+    @staticmethod
+    def current():
+        """:return UnitOfWork of current update or None"""
+        return _unit_of_work.get()
+
+    @staticmethod
+    def detach():
+        """Makes model calls of current task run in their own transactions (for background tasks started by handlers)"""
+        _unit_of_work.set(None)
+
+    def open_session(self, use_async: bool = False):
+        """:return session for one model call (with models changed by previous calls of this unit of work)"""
+        session = _new_session(use_async, query_cls=UnitOfWorkQuery, autoflush=False, info={'unit_of_work': self})
+        session.add_all(self._changed.values())
+        return session
+
+    async def run(self, function, args: tuple, kwargs: dict):
+        """Calls model function with its own session of this unit of work"""
+        if not async_engine_ready():
+            return function(*args, **kwargs)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            started = time.monotonic()
+            session = self.open_session(use_async=True)
+            try:
+                return await session.run_sync(_call_bound, self, function, args, kwargs)
+            finally:
+                await session.close()
+                metrics.db_session_seconds.observe(time.monotonic() - started, result='call')
+
+    def remember(self, session: Session):
+        """Remembers models added or changed in session (by session.commit() of model method)"""
+        for model in itertools.chain(session.new, session.dirty):
+            self._changed[id(model)] = model
+        self.writes += 1
+
+    def defer(self, query: orm.Query, method: str, args: tuple, kwargs: dict):
+        """Remembers bulk query.update() or query.delete(), it's made by UnitOfWork.finish"""
+        self._statements.append((query, method, args, kwargs))
+
+    def insert(self, session: Session):
+        """Inserts models added to session and commits them right away (changed models are still only remembered)"""
+        changed = list(session.dirty)
+        for model in changed:
+            self._changed[id(model)] = model
+            session.expunge(model)
+        inserted = list(session.new)
+        session.commit()
+        self._inserted.extend(inserted)
+        self.commits += 1
+        session.add_all(changed)
+
+    async def finish(self, success: bool = True):
+        """
+        Writes all remembered changes in one transaction (or deletes rows inserted by the update if it failed)
+        :param success: False if update failed and its changes must be discarded
+        """
+        if self._token is not None:
+            _unit_of_work.reset(self._token)
+            self._token = None
+
+        try:
+            if success and (self._changed or self._statements):
+                await self._transaction(self._write, 'commit')
+                self.commits += 1
+        except BaseException:
+            success = False
+            raise
+        finally:
+            if (not success) and self._inserted:
+                await self._transaction(self._delete_inserted, 'rollback')
+            self._changed, self._statements, self._inserted = {}, [], []
+
+    def _write(self, session: Session):
+        session.add_all(self._changed.values())
+        session.flush()
+        for query, method, args, kwargs in self._statements:
+            getattr(query.with_session(session), method)(*args, **kwargs)
+        session.commit()
+
+    def _delete_inserted(self, session: Session):
+        for model in reversed(self._inserted):  # rows that refer to other rows were inserted after them
+            session.delete(model)
+            session.flush()
+        session.commit()
+
+    async def _transaction(self, function, result: str):
+        """Calls function(session) with new session of sync (or async) engine, function commits changes itself"""
+        started = time.monotonic()
+        session = _new_session(use_async=async_engine_ready())
+        try:
+            if async_engine_ready():
+                await session.run_sync(function)
+            else:
+                function(session)
+        finally:
+            await _maybe_await(session.close())
+            metrics.db_session_seconds.observe(time.monotonic() - started, result=result)
+
+
+class UnitOfWorkQuery(orm.Query):
+    """Query of session of UnitOfWork: bulk update() and delete() are made by UnitOfWork.finish"""
+
+    def update(self, *args, **kwargs):
+        unit_of_work: UnitOfWork = self.session.info.get('unit_of_work')
+        if unit_of_work is None:  # replayed by UnitOfWork.finish
+            return super().update(*args, **kwargs)
+        unit_of_work.defer(self, 'update', args, kwargs)
+
+    def delete(self, *args, **kwargs):
+        unit_of_work: UnitOfWork = self.session.info.get('unit_of_work')
+        if unit_of_work is None:
+            return super().delete(*args, **kwargs)
+        unit_of_work.defer(self, 'delete', args, kwargs)
+
+
+def async_engine_ready() -> bool:
+    """:return True if global_init_async connected async engine"""
+    return __async_factory is not None
+
+
+def _new_session(use_async: bool = False, **kwargs):
+    """Creates session of sync (or async) engine"""
+    return __async_factory(**kwargs) if use_async else __factory(**kwargs)
+
+
+def _call_bound(session: Session, unit_of_work: UnitOfWork, function, args: tuple, kwargs: dict):
+    """Calls function, so every create_session() inside it returns session"""
+    token = _bound_session.set(BoundSession(session, unit_of_work))
+    try:
+        return function(*args, **kwargs)
+    finally:
+        _bound_session.reset(token)
+
+
+async def _maybe_await(result):
+    """Awaits result of AsyncSession method (methods of sync Session return None)"""
+    if inspect.isawaitable(result):
+        await result
+
+
+class BoundSession:
+    """
+    Session of one model call inside UnitOfWork: commit() only remembers changes for UnitOfWork.finish,
+    flush() inserts added models right away (when their ids or rows are needed by the update)
+    """
+
+    def __init__(self, session: Session, unit_of_work: UnitOfWork, owned: bool = False):
+        """:param owned: True if session is closed by model method (otherwise by UnitOfWork.run)"""
+        self._session = session
+        self._unit_of_work = unit_of_work
+        self._owned = owned
+
+    def __getattr__(self, name: str):
+        return getattr(self._session, name)
+
+    def commit(self):
+        self._unit_of_work.remember(self._session)
+
+    def flush(self):
+        self._unit_of_work.insert(self._session)
+
+    def close(self):
+        if self._owned:
+            self._session.close()
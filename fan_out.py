@@ -0,0 +1,81 @@
+import asyncio
+import logging
+from collections import Counter
+
+import aiohttp
+from aiogram.utils.exceptions import TelegramAPIError, MessageNotModified
+from aiogram.utils.exceptions import MessageToEditNotFound, MessageCantBeEdited, MessageIdInvalid, MessageToReplyNotFound
+from aiogram.utils.exceptions import BotBlocked, UserDeactivated, ChatNotFound
+
+from database import UnitOfWork
+
+
+MISSING_ERRORS = (  # message (or chat) is deleted, so there is nothing to retry
+    MessageToEditNotFound, MessageCantBeEdited, MessageIdInvalid, MessageToReplyNotFound,
+    BotBlocked, UserDeactivated, ChatNotFound
+)
+FAILED_ERRORS = (TelegramAPIError, aiohttp.ClientError, asyncio.TimeoutError)  # call failed, others are still made
+
+
+class FanOut:
+    """
+    Makes many Telegram API calls at the same time (at most `limit` at once, rate limits are kept by send queue of bot).
+    Failure of one call doesn't stop others, results of all calls are counted and written to log
+    """
+
+    def __init__(self, limit: int = 10):
+        """:param limit: max amount of calls that are made at the same time"""
+        self.limit = limit
+        self._tasks = set()  # running asyncio.Task started by FanOut.start
+
+    async def run(self, calls: list, description: str) -> Counter:
+        """
+        :param calls: [(name of call for log, async function without arguments that makes call), ...]
+        :param description: string that represents what calls do, for summary in log
+        :return: Counter of results: 'done', 'unchanged' (edited message already has this text),
+                 'missing' (message or chat is deleted or bot is blocked), 'failed' (other Telegram, network and timeout errors)
+        """
+        semaphore = asyncio.Semaphore(self.limit)
+
+        async def make(name: str, call) -> str:
+            async with semaphore:
+                try:
+                    await call()
+                except MessageNotModified:
+                    return 'unchanged'
+                except MISSING_ERRORS as error:
+                    logging.info('%s skipped: %s', name, error)
+                    return 'missing'
+                except FAILED_ERRORS as error:
+                    logging.warning('%s failed: %s %s', name, error.__class__.__name__, error)
+                    return 'failed'
+                return 'done'
+
+        results = Counter(await asyncio.gather(*(make(name, call) for name, call in calls)))
+        logging.info(
+            '%s: %s calls, %s done, %s unchanged, %s missing, %s failed', description, len(calls),
+            results['done'], results['unchanged'], results['missing'], results['failed']
+        )
+        return results
+
+    def start(self, calls: list, description: str):
+        """
+        Same as FanOut.run, but in background, so update (or timer) that prepared calls doesn't keep its transaction
+        open while rate limited calls are waiting
+        """
+        task = asyncio.get_event_loop().create_task(self._run_detached(calls, description))
+        self._tasks.add(task)
+        task.add_done_callback(self._finished)
+
+    async def stop(self):
+        """Waits for calls started in background"""
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _run_detached(self, calls: list, description: str) -> Counter:
+        UnitOfWork.detach()  # unit of work of update that started calls is finished before them
+        return await self.run(calls, description)
+
+    def _finished(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if (not task.cancelled()) and (task.exception() is not None):
+            logging.error('Fan out failed', exc_info=task.exception())
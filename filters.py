@@ -1,11 +1,13 @@
 from aiogram.types import Message
 
-from models import User, Team
+from config import get_config
+from context import UpdateContext
+from team_chats import team_chats
 
 
-def user_not_in_database(message: Message) -> bool:
+async def user_not_in_database(message: Message) -> bool:
     """Returns True when User is not in database"""
-    return User.get(message.from_user.id) is None
+    return await UpdateContext.current(message.from_user.id).load_user() is None
 
 
 def is_group_chat(message: Message) -> bool:
@@ -13,58 +15,72 @@ def is_group_chat(message: Message) -> bool:
     return message.chat.id != message.from_user.id
 
 
-def state_is(message: Message, state: str) -> bool:
+def is_admin_chat(message: Message) -> bool:
+    """Returns True when message from config.json -> admin_chat"""
+    return message.chat.id == get_config().admin_chat
+
+
+async def user_state(message: Message) -> str:
+    """Returns User.state of message sender"""
+    return (await UpdateContext.current(message.from_user.id).load_user()).state
+
+
+async def state_is(message: Message, state: str) -> bool:
     """Returns True when User.state == state"""
-    return User.get(message.from_user.id).state == state
+    return await user_state(message) == state
 
 
-def is_register_menu(message: Message) -> bool:
-    """Returns True when User.state is like 'registerID' where ID is positive integer number"""
-    state = User.get(message.from_user.id).state
+def is_register_menu(state: str) -> bool:
+    """Returns True when state is like 'registerID' where ID is positive integer number"""
     return state[:8] == 'register' and state[8:].isdigit()
 
 
-def is_question_menu(message: Message) -> bool:
-    """Returns True when 'question' in User.state"""
-    return 'question' in User.get(message.from_user.id).state
+def is_question_menu(state: str) -> bool:
+    """Returns True when 'question' in state"""
+    return 'question' in state
+
+
+def is_suggestion_menu(state: str) -> bool:
+    """Returns True when 'suggest' in state"""
+    return 'suggest' in state
 
 
-def is_suggestion_menu(message: Message) -> bool:
-    """Returns True when 'suggest' in User.state"""
-    return 'suggest' in User.get(message.from_user.id).state
+def is_upload_menu(state: str) -> bool:
+    """Returns True when 'upload' in state"""
+    return 'upload' in state
 
 
-def is_upload_menu(message: Message) -> bool:
-    """Returns True when 'upload' in User.state"""
-    return 'upload' in User.get(message.from_user.id).state
+async def in_upload_menu(message: Message) -> bool:
+    """Returns True when User.state of message sender is upload menu"""
+    return is_upload_menu(await user_state(message))
 
 
-def is_faq_menu(message: Message) -> bool:
-    """Returns True when 'faq' in User.state"""
-    return 'faq' in User.get(message.from_user.id).state
+def is_faq_menu(state: str) -> bool:
+    """Returns True when 'faq' in state"""
+    return 'faq' in state
 
 
-def is_login_menu(message: Message) -> bool:
-    """Returns True when 'login' in User.state"""
-    return 'login' in User.get(message.from_user.id).state
+def is_login_menu(state: str) -> bool:
+    """Returns True when 'login' in state"""
+    return 'login' in state
 
 
-def is_edit_menu(message: Message) -> bool:
-    """Returns True when 'edit' in User.state"""
-    return 'edit' in User.get(message.from_user.id).state
+def is_edit_menu(state: str) -> bool:
+    """Returns True when 'edit' in state"""
+    return 'edit' in state
 
 
-def is_join_menu(message: Message) -> bool:
-    """Returns True when 'join' in User.state"""
-    return 'join' in User.get(message.from_user.id).state
+def is_join_menu(state: str) -> bool:
+    """Returns True when 'join' in state"""
+    return 'join' in state
 
 
-def is_create_menu(message: Message) -> bool:
-    """Returns True when 'create' in User.state"""
-    return 'create' in User.get(message.from_user.id).state
+def is_create_menu(state: str) -> bool:
+    """Returns True when 'create' in state"""
+    return 'create' in state
 
 
 def is_team_chat(message: Message) -> bool:
     """Return True when message from team chat"""
-    return (message.chat.id,) in Team.get_all_chats()
+    return message.chat.id in team_chats
 
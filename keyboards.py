@@ -0,0 +1,91 @@
+import functools
+
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types.reply_keyboard import ReplyKeyboardRemove
+
+from answers import get_answers
+from config import get_config
+from bot_functions import get_reply, has_keyboard_buttons, has_inline_buttons, render
+from models import UserInfo
+
+
+MARKUP_CACHE_SIZE = 1024
+_markup_versions = None  # (answers.json version, config.json version) of cached markups
+
+
+def get_markup(user_state: str = "*", message_text: str = "", skip: list or tuple = tuple(), safe: bool = True, buttons: list = None, buttons_type: str = None) -> ReplyKeyboardMarkup or InlineKeyboardMarkup or ReplyKeyboardRemove:
+    """
+    Returns ButtonMarkup that depends on next User.state
+    Markups from answers.json are cached, so they MUST NOT be changed (use fill_user_info to get changed copy)
+    """
+    if buttons is not None:  # If buttons already parsed
+        if buttons_type == '#KeyboardButtons':
+            keyboard = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+            for button in buttons:
+                if button['text'] not in skip:
+                    keyboard.add(KeyboardButton(button['text']))
+            return keyboard
+        elif buttons_type == '#InlineButtons':
+            keyboard = InlineKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+            for button in buttons:
+                keyboard.add(InlineKeyboardButton(button['text'], callback_data=button['command'], url=button.get('url')))
+            return keyboard
+
+    global _markup_versions
+    versions = (get_answers().version, get_config().version)
+    if versions != _markup_versions:  # answers.json or config.json reloaded
+        build_markup.cache_clear()
+        _markup_versions = versions
+    return build_markup(*markup_key(user_state, message_text, safe), tuple(skip))
+
+
+def markup_key(user_state: str, message_text: str, safe: bool) -> (str, str):
+    """
+    Returns (state, text) that lead to the same reply as (user_state, message_text),
+    so unknown states and messages share one cache entry with '*'
+    """
+    answers = get_answers()
+    if user_state not in answers.states:
+        user_state = '*'
+    if safe and message_text in get_config().restricted_messages:
+        message_text = '*'
+    if message_text not in answers.state(user_state):
+        message_text = '*'
+    return user_state, message_text
+
+
+@functools.lru_cache(maxsize=MARKUP_CACHE_SIZE)
+def build_markup(user_state: str, message_text: str, skip: tuple) -> ReplyKeyboardMarkup or InlineKeyboardMarkup or ReplyKeyboardRemove:
+    """Builds ButtonMarkup for (user_state, message_text) from markup_key"""
+    if has_keyboard_buttons(user_state, message_text, safe=False):  # If next User.state has KeyboardButtons
+        keyboard = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+        for button in get_reply(user_state, message_text, keyboard_buttons=True, safe=False):
+            if button['text'] not in skip:
+                keyboard.add(KeyboardButton(button['text']))
+        return keyboard
+    elif has_inline_buttons(user_state, message_text, safe=False):  # If next User.state has InlineButtons
+        keyboard = InlineKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+        for button in get_reply(user_state, message_text, inline_buttons=True, safe=False):
+            keyboard.add(InlineKeyboardButton(button['text'], callback_data=button['command'], url=button.get('url')))
+        return keyboard
+    return ReplyKeyboardRemove()  # If no buttons needed, deletes all that was
+
+
+def fill_user_info(keyboard: ReplyKeyboardMarkup or InlineKeyboardMarkup or ReplyKeyboardRemove, user_info: UserInfo) -> ReplyKeyboardMarkup or InlineKeyboardMarkup or ReplyKeyboardRemove:
+    """Returns copy of keyboard with replaced %parameters% in inline buttons (keyboard is returned as is if nothing to replace)"""
+    if ('inline_keyboard' not in keyboard) or all('%' not in button.text for button_list in keyboard.inline_keyboard for button in button_list):
+        return keyboard
+
+    values = {
+        'name': user_info.name,
+        'surname': user_info.surname,
+        'patronymic': user_info.patronymic if user_info.patronymic is not None else 'Нет',
+        'email': user_info.email,
+        'job': user_info.job
+    }
+    keyboard = InlineKeyboardMarkup.to_object(keyboard.to_python())
+    for button_list in keyboard.inline_keyboard:
+        for button in button_list:
+            button.text = render(button.text, values)
+    return keyboard
@@ -0,0 +1,611 @@
+"""
+Load test of the bot: many synthetic users talk to dispatcher at the same time.
+Telegram is replaced by FakeTelegram, AXIOM server by StubAxiom, database is temporary SQLite (or --database).
+Updates are passed straight to dispatcher (--mode direct, speed of handlers only), received by dp.start_polling
+from fake getUpdates (--mode polling) or POSTed to webhook app of aiogram (--mode webhook),
+--mode all runs the same conversations all three ways one after another.
+
+python loadtest.py --users 100 --rounds 3 --json results.json
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiohttp import web
+
+
+MESSAGE_METHODS = {'sendMessage', 'editMessageText', 'sendPoll', 'forwardMessage', 'copyMessage', 'sendPhoto', 'sendDocument'}
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'AXIOM', 'username': 'axiom_load_test_bot'}
+FIRST_USER_ID = 10_000_000
+FIRST_TEAM_CHAT_ID = -1_000_000_000_000
+MODERATOR_ID = 7
+COMPETITION_ID = 1
+ID_PATTERN = re.compile(r'[A-Z]{3}_\d+|-?\d+')  # ids in AXIOM links (telegram ids and AXIOM ids)
+MODES = ('direct', 'polling', 'webhook')
+UPDATE_TIMEOUT = 60  # max amount of seconds to wait for polled update to be handled
+
+
+class FakeTelegram:
+    """Replies to Bot API requests instead of Telegram and remembers what was sent"""
+
+    def __init__(self):
+        self.calls = collections.Counter()  # {method: amount}, getUpdates is not counted
+        self.polls = 0  # amount of getUpdates requests
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._updates = []  # [update dict, ...] not confirmed by offset of getUpdates yet
+        self._arrived = asyncio.Event()  # wakes up long polling getUpdates
+        self._group_messages = {}  # {(chat_id, text): message_id} of messages sent to groups
+        self._buttons = {}  # {chat_id: [callback_data, ...]} of the last inline keyboard sent to private chat
+
+    async def make_request(self, session, server, token, method: str, data: dict = None, files: dict = None, **kwargs):
+        """Same signature as aiogram.bot.api.make_request"""
+        data = data or {}
+        if method == 'getUpdates':
+            return await self._get_updates(data)
+        self.calls[method] += 1
+        chat_id = data.get('chat_id')
+        if method in MESSAGE_METHODS:
+            return self._message(method, data)
+        if method == 'stopPoll':
+            return self._poll(data)
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getChat':
+            return {'id': chat_id, 'type': 'supergroup', 'title': 'Team'}
+        if method == 'getChatMember':
+            return {'user': BOT_USER, 'status': 'administrator'}
+        if method == 'createChatInviteLink':
+            return {'invite_link': 'https://t.me/+load_test', 'creator': BOT_USER, 'creates_join_request': False, 'is_primary': False, 'is_revoked': False}
+        return True
+
+    def push_update(self, update: dict) -> int:
+        """
+        Adds update for getUpdates (update_id is replaced, so ids grow in order updates are pushed)
+        :return: update_id of update
+        """
+        update = dict(update, update_id=next(self._update_ids))
+        self._updates.append(update)
+        self._arrived.set()
+        return update['update_id']
+
+    def wake_up(self):
+        """Makes waiting getUpdates return right away (so polling can be stopped)"""
+        self._arrived.set()
+
+    async def _get_updates(self, data: dict) -> list:
+        """Long polling like Telegram: waits up to `timeout` seconds for updates after `offset`"""
+        self.polls += 1
+        offset = int(data.get('offset') or 0)
+        self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        if not self._updates and data.get('timeout'):
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), float(data['timeout']))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(data.get('limit') or 100)]
+
+    def find_message(self, chat_id: int, text: str) -> (int, str) or None:
+        """:return (message_id, text) of message sent to group chat_id that ends with text"""
+        for (message_chat_id, message_text), message_id in self._group_messages.items():
+            if message_chat_id == chat_id and message_text.endswith(text):
+                return message_id, message_text
+        return None
+
+    def buttons(self, chat_id: int) -> list:
+        """:return [callback_data, ...] of the last inline keyboard sent to private chat"""
+        return self._buttons.get(chat_id, [])
+
+    def _message(self, method: str, data: dict) -> dict:
+        chat_id = data.get('chat_id')
+        message_id = data.get('message_id') if method == 'editMessageText' else next(self._message_ids)
+        text = data.get('text') or data.get('question') or ''
+        message = {
+            'message_id': message_id, 'date': int(time.time()), 'text': text, 'from': BOT_USER,
+            'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'}
+        }
+        if method == 'sendPoll':
+            message['poll'] = self._poll(data)
+
+        if chat_id < 0:
+            self._group_messages[(chat_id, text)] = message_id
+        elif 'reply_markup' in data:
+            markup = json.loads(data['reply_markup']) if isinstance(data['reply_markup'], str) else data['reply_markup']
+            self._buttons[chat_id] = [str(button['callback_data']) for row in markup.get('inline_keyboard', []) for button in row]
+        return message
+
+    @staticmethod
+    def _poll(data: dict) -> dict:
+        options = json.loads(data['options']) if isinstance(data.get('options'), str) else (data.get('options') or ['Да', 'Нет'])
+        return {
+            'id': str(data.get('message_id', 0)), 'question': data.get('question', ''), 'total_voter_count': 0,
+            'options': [{'text': option, 'voter_count': 0} for option in options], 'is_closed': False,
+            'is_anonymous': False, 'type': 'regular', 'allows_multiple_answers': False
+        }
+
+
+class StubAxiom:
+    """AXIOM server that replies successfully to every request (listens on random local port)"""
+
+    def __init__(self, team_chats: list, latency: float = 0.0):
+        """
+        :param team_chats: [chat_id, ...] of teams returned by /teams
+        :param latency: amount of seconds every reply is delayed
+        """
+        self.team_chats = team_chats
+        self.latency = latency
+        self.calls = collections.Counter()  # {'METHOD /link': amount}, ids in links are replaced by {id}
+        self.url: str = None
+        self._dialog_ids = itertools.count(1)
+        self._runner: web.AppRunner = None
+
+    async def start(self) -> str:
+        """:return url of server"""
+        app = web.Application()
+        app.router.add_route('*', '/{tail:.*}', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.url = f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}'
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        link = request.path[len('/api/v1'):]
+        self.calls[f"{request.method} {ID_PATTERN.sub('{id}', link)}"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if link == '/competitions':
+            data = [{'id': COMPETITION_ID, 'name': 'Competition'}]
+        elif link == '/teams':
+            data = [{'chatId': chat_id, 'name': f'Team {number}'} for number, chat_id in enumerate(self.team_chats, 1)]
+        elif request.method == 'POST' and link.endswith('/dialog'):
+            data = {'dialogId': next(self._dialog_ids)}
+        elif link.startswith('/user/'):
+            data = {'profession': ['Инженер'], 'axiomId': 'AAA_0000', 'firstName': 'Иван', 'lastName': 'Иванов', 'telegramId': link.split('/')[-1]}
+        else:
+            data = None
+        return web.json_response({'success': True, 'data': data})
+
+
+class WebhookServer:
+    """Webhook app of aiogram (the same bot.py runs in webhook mode) on random local port, posts updates to it"""
+
+    def __init__(self, dispatcher, path: str, max_connections: int):
+        """
+        :param dispatcher: Dispatcher of bot.py
+        :param path: path of webhook (config.json -> webhook_path)
+        :param max_connections: max amount of updates that are posted at the same time, like Telegram does
+        """
+        self.dispatcher = dispatcher
+        self.path = path
+        self.max_connections = max_connections
+        self.url: str = None
+        self._runner: web.AppRunner = None
+        self._session: aiohttp.ClientSession = None
+
+    async def start(self) -> str:
+        """:return url of webhook"""
+        from aiogram.dispatcher.webhook import get_new_configured_app
+
+        self._runner = web.AppRunner(get_new_configured_app(self.dispatcher, self.path), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.url = f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}{self.path}'
+        self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections))
+        return self.url
+
+    async def stop(self):
+        if self._session is not None:
+            await self._session.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def post(self, update):
+        """Posts update and waits for reply of webhook (raises ClientResponseError if handler failed)"""
+        async with self._session.post(self.url, json=update.to_python()) as response:
+            response.raise_for_status()
+
+
+class UpdateWaiter(BaseMiddleware):
+    """
+    Tells when polled update is handled: the last middleware of dispatcher, so its post process is called
+    after UnitOfWorkMiddleware committed the update
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._futures = {}  # {update_id: asyncio.Future}
+
+    def expect(self, update_id: int) -> asyncio.Future:
+        """:return future that gets results of handlers (or exception of update) when update is handled"""
+        future = self._futures[update_id] = asyncio.get_event_loop().create_future()
+        return future
+
+    async def on_post_process_update(self, update, results: list, data: dict):
+        future = self._futures.pop(update.update_id, None)
+        if (future is None) or future.done():
+            return
+        error = sys.exc_info()[1]  # post process is called from `finally`, so exception of update is visible here
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(results)
+
+
+class QueryCounter:
+    """Counts SQL statements sent by all engines"""
+
+    def __init__(self):
+        self.queries = collections.Counter()  # {'SELECT': amount, ...}
+
+    def install(self):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        event.listen(Engine, 'before_cursor_execute', self._count)
+
+    def reset(self):
+        self.queries.clear()
+
+    def _count(self, connection, cursor, statement: str, parameters, context, executemany: bool):
+        self.queries[statement.lstrip().split(None, 1)[0].upper()] += 1
+
+
+class LoadTest:
+    """Runs conversations of virtual users and collects latency of every update"""
+
+    def __init__(self, bot_module, telegram: FakeTelegram, think_time: float, seed: int,
+                 waiter: UpdateWaiter = None, webhook: WebhookServer = None):
+        """
+        :param bot_module: imported bot.py
+        :param telegram: FakeTelegram that answers bot
+        :param think_time: max amount of seconds user waits before next message
+        :param seed: seed of random generator (same seed gives same conversations)
+        :param waiter: UpdateWaiter of dispatcher that is polling FakeTelegram, updates are given to getUpdates
+        :param webhook: started WebhookServer to post updates to
+        (without waiter and webhook updates are passed straight to dispatcher)
+        """
+        self.bot = bot_module
+        self.telegram = telegram
+        self.waiter = waiter
+        self.webhook = webhook
+        self.think_time = think_time
+        self.random = random.Random(seed)
+        self.latencies = collections.defaultdict(list)  # {flow: [seconds, ...]}
+        self.errors = collections.Counter()  # {exception class name: amount}
+        self._ids = itertools.count(1)
+
+    async def process(self, flow: str, update):
+        """
+        Passes update to dispatcher (through all middlewares), to getUpdates or to webhook
+        and saves its latency (until update is handled)
+        """
+        if self.think_time:
+            await asyncio.sleep(self.random.uniform(0, self.think_time))
+        started = time.perf_counter()
+        try:
+            if self.webhook is not None:
+                await self.webhook.post(update)
+            elif self.waiter is not None:
+                await asyncio.wait_for(self.waiter.expect(self.telegram.push_update(update.to_python())), UPDATE_TIMEOUT)
+            else:
+                await self.bot.dp.process_updates([update])
+        except Exception as error:
+            self.failed(flow, error)
+        self.latencies[flow].append(time.perf_counter() - started)
+
+    def failed(self, flow: str, error: Exception):
+        """Counts error (the first error of every kind is logged)"""
+        if error.__class__.__name__ not in self.errors:
+            logging.error(f'{flow} failed', exc_info=error)
+        self.errors[error.__class__.__name__] += 1
+
+    async def send(self, flow: str, user_id: int, text: str, chat_id: int = None, reply_to: dict = None):
+        """Sends message from user_id to private chat (or to group chat_id)"""
+        from aiogram import types
+
+        message = {
+            'message_id': next(self._ids), 'date': int(time.time()), 'text': text,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load', 'language_code': 'ru'},
+            'chat': {'id': user_id, 'type': 'private'} if chat_id is None else {'id': chat_id, 'type': 'supergroup', 'title': 'Moderators'}
+        }
+        if reply_to is not None:
+            message['reply_to_message'] = reply_to
+        await self.process(flow, types.Update(update_id=next(self._ids), message=message))
+
+    async def press(self, flow: str, user_id: int, data: str):
+        """Presses inline button with callback data"""
+        from aiogram import types
+
+        callback_query = {
+            'id': str(next(self._ids)), 'chat_instance': str(user_id), 'data': data,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load', 'language_code': 'ru'},
+        }
+        await self.process(flow, types.Update(update_id=next(self._ids), callback_query=callback_query))
+
+    async def registration(self, user_id: int):
+        """register1 -> register6 from answers.json"""
+        for text in ['/start', '/register', 'Иванов', 'Иван', '/skip', f'user{user_id}@example.com', 'Инженер', 'Программист']:
+            await self.send('registration', user_id, text)
+
+    async def question(self, user_id: int, number: int):
+        """New question, moderator reply in moderator_chat, closing of question"""
+        moderator_chat = self.bot.get_config().moderator_chat
+        text = f'Question {number} from {user_id}'
+        for message in ['/ask', '/new_question', 'Соревнования', text]:
+            await self.send('question', user_id, message)
+
+        sent = self.telegram.find_message(moderator_chat, text)
+        if sent is not None:
+            message_id, message_text = sent
+            reply_to = {'message_id': message_id, 'date': int(time.time()), 'text': message_text, 'chat': {'id': moderator_chat, 'type': 'supergroup'}}
+            await self.send('moderator_reply', MODERATOR_ID, f'Answer to {user_id}', chat_id=moderator_chat, reply_to=reply_to)
+
+        await self.send('question', user_id, '/my_questions')
+        discussions = [data for data in self.telegram.buttons(user_id) if data.isdigit()]
+        if discussions:
+            await self.press('question', user_id, max(discussions, key=int))
+            await self.send('question', user_id, '/close')
+        else:
+            await self.press('question', user_id, '/cancel')
+        await self.send('question', user_id, '/leave')
+
+    async def join_team(self, user_id: int):
+        """Application to team: join_competitions -> join_team -> poll in team chat"""
+        try:
+            user = await self.bot.User.aio.get(user_id)
+            await user.aio.set(state='join')  # answers.json has no button that leads to join menu
+        except Exception as error:
+            self.failed('join_team', error)
+            return
+        await self.send('join_team', user_id, '/join')
+        await self.press('join_team', user_id, str(COMPETITION_ID))
+        teams = [data for data in self.telegram.buttons(user_id) if data.lstrip('-').isdigit()]
+        if teams:
+            await self.press('join_team', user_id, self.random.choice(teams))
+        await self.press('join_team', user_id, '/leave')
+
+    async def suggestion(self, user_id: int, number: int):
+        """New suggestion that is sent to admin_chat"""
+        for text in ['/suggest', '/new_suggestion', 'Другое', f'Suggestion {number} from {user_id}', '/leave']:
+            await self.send('suggestion', user_id, text)
+
+    async def conversation(self, user_id: int, rounds: int, delay: float):
+        """Registration and then every flow once per round in random order"""
+        await asyncio.sleep(delay)
+        await self.registration(user_id)
+        for number in range(rounds):
+            flows = [lambda: self.question(user_id, number), lambda: self.join_team(user_id), lambda: self.suggestion(user_id, number)]
+            self.random.shuffle(flows)
+            for flow in flows:
+                await flow()
+
+
+def percentile(values: list, percent: float) -> float:
+    """:return value that is bigger than percent % of values (nearest rank)"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))]
+
+
+def latency_summary(values: list) -> dict:
+    """:return amount of updates and latency percentiles in milliseconds"""
+    return {
+        'updates': len(values),
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'max_ms': round(max(values, default=0.0) * 1000, 3)
+    }
+
+
+async def run(args: argparse.Namespace) -> dict:
+    """:return {mode: results} for every mode of --mode"""
+    team_chats = [FIRST_TEAM_CHAT_ID - number for number in range(args.teams)]
+    axiom = StubAxiom(team_chats, args.api_latency)
+    os.environ['SERVER'] = await axiom.start()
+    os.environ['CONNECTION_STRING'] = args.database
+    os.environ.setdefault('BOT_TOKEN', '123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA')
+
+    from aiogram import Bot, Dispatcher
+    import aiogram.bot.api
+    telegram = FakeTelegram()
+    aiogram.bot.api.make_request = telegram.make_request
+    queries = QueryCounter()
+    queries.install()
+
+    import bot as bot_module
+    if not args.send_queue:  # Telegram rate limits would hide speed of handlers
+        bot_module.bot.request = lambda method, data=None, files=None, **kwargs: Bot.request(bot_module.bot, method, data, files, **kwargs)
+    Bot.set_current(bot_module.bot)
+    Dispatcher.set_current(bot_module.dp)
+    waiter = UpdateWaiter()
+    bot_module.dp.middleware.setup(waiter)
+
+    owner_id = FIRST_USER_ID - 1
+    if await bot_module.User.aio.get(owner_id) is None:
+        await bot_module.User.aio.add(owner_id)
+    for number, chat_id in enumerate(team_chats, 1):
+        if await bot_module.Team.aio.get(chat_id) is None:
+            await bot_module.Team.aio.add(chat_id, owner_id, COMPETITION_ID)
+            await (await bot_module.Team.aio.get(chat_id)).aio.set(title=f'Team {number}', description='Load test team')
+    await bot_module.on_startup(bot_module.dp)
+
+    results = {}
+    for mode in (MODES if args.mode == 'all' else (args.mode,)):
+        results[mode] = await play(args, mode, bot_module, telegram, axiom, queries, waiter)
+
+    await bot_module.on_shutdown(bot_module.dp)
+    await (await bot_module.bot.get_session()).close()
+    await axiom.stop()
+    return results
+
+
+async def play(args: argparse.Namespace, mode: str, bot_module, telegram: FakeTelegram, axiom: StubAxiom,
+               queries: QueryCounter, waiter: UpdateWaiter) -> dict:
+    """
+    Runs conversations of all users once (bot is started already)
+    :param mode: 'direct', 'polling' or 'webhook'
+    :return: results of run
+    """
+    from answers import answers_file
+    from config import config_file
+
+    watched_files = {'answers.json': answers_file, 'config.json': config_file}
+    polling = webhook = None
+    if mode == 'polling':
+        # polling can be started only once per dispatcher, so there is only one polling run per process
+        polling = asyncio.get_event_loop().create_task(bot_module.dp.start_polling())  # arguments of executor.start_polling
+    elif mode == 'webhook':
+        config = bot_module.get_config()
+        webhook = WebhookServer(bot_module.dp, config.webhook_path, config.webhook_max_connections)
+        await webhook.start()
+
+    test = LoadTest(bot_module, telegram, args.think_time, args.seed, waiter if polling else None, webhook)
+    # new users on every run with the same --database, users of different modes don't meet each other
+    first_user_id = FIRST_USER_ID + (args.seed * len(MODES) + MODES.index(mode)) * args.users
+    queries.reset()
+    telegram.calls.clear()
+    telegram.polls = 0
+    axiom.calls.clear()
+    for file in watched_files.values():
+        file.get()  # the first parse is made here, not by the first update
+    loads = {name: file.loads for name, file in watched_files.items()}
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        test.conversation(first_user_id + number, args.rounds, args.ramp_up * number / args.users)
+        for number in range(args.users)
+    ))
+    duration = time.perf_counter() - started
+
+    if polling is not None:
+        bot_module.dp.stop_polling()
+        telegram.wake_up()
+        await polling
+    if webhook is not None:
+        await webhook.stop()
+    await bot_module.fan_out.stop()  # requests that are waiting in background or in outbox are counted as API calls too
+    await bot_module.outbox_worker.stop()
+    while await bot_module.outbox_worker.deliver_batch():
+        pass
+    bot_module.outbox_worker.start()  # for the next mode, on_shutdown stops it
+
+    all_latencies = [latency for latencies in test.latencies.values() for latency in latencies]
+    updates = len(all_latencies)
+    return {
+        'mode': mode,
+        'users': args.users,
+        'rounds': args.rounds,
+        'database': args.database.split('://')[0],
+        'send_queue': args.send_queue,
+        'duration_s': round(duration, 3),
+        'updates': updates,
+        'errors': dict(test.errors),
+        'updates_per_second': round(updates / duration, 2) if duration else 0.0,
+        'latency': latency_summary(all_latencies),
+        'flows': {flow: latency_summary(latencies) for flow, latencies in sorted(test.latencies.items())},
+        'db_queries_per_update': round(sum(queries.queries.values()) / max(updates, 1), 2),
+        'db_queries': dict(queries.queries),
+        'api_calls_per_update': round(sum(axiom.calls.values()) / max(updates, 1), 3),
+        'api_calls': dict(axiom.calls),
+        'telegram_calls_per_update': round(sum(telegram.calls.values()) / max(updates, 1), 3),
+        'telegram_calls': dict(telegram.calls),
+        'updates_per_get_updates': round(updates / telegram.polls, 2) if telegram.polls else None,
+        'file_loads': {name: file.loads - loads[name] for name, file in watched_files.items()}  # files don't change, so must be 0
+    }
+
+
+def print_report(results: dict):
+    latency = results['latency']
+    print(f"[{results['mode']}] {results['updates']} updates from {results['users']} users in {results['duration_s']} s: {results['updates_per_second']} updates/s")
+    print(f"latency p50 {latency['p50_ms']} ms, p95 {latency['p95_ms']} ms, p99 {latency['p99_ms']} ms, max {latency['max_ms']} ms")
+    for flow, summary in results['flows'].items():
+        print(f"  {flow:<16} {summary['updates']:>7} updates  p50 {summary['p50_ms']:>9} ms  p95 {summary['p95_ms']:>9} ms  p99 {summary['p99_ms']:>9} ms")
+    print(f"db queries per update: {results['db_queries_per_update']} {results['db_queries']}")
+    print(f"api calls per update: {results['api_calls_per_update']}")
+    print(f"telegram calls per update: {results['telegram_calls_per_update']}")
+    if results['updates_per_get_updates'] is not None:
+        print(f"updates per getUpdates: {results['updates_per_get_updates']}")
+    print(f"json files parsed during test: {results['file_loads']}")
+    if results['errors']:
+        print(f"errors: {results['errors']}")
+
+
+def print_comparison(results: dict):
+    """Prints main numbers of all modes of the same run next to each other"""
+    print('mode        updates/s        p50 ms        p95 ms        p99 ms')
+    for mode, mode_results in results.items():
+        latency = mode_results['latency']
+        print(f"{mode:<8} {mode_results['updates_per_second']:>12} {latency['p50_ms']:>13} {latency['p95_ms']:>13} {latency['p99_ms']:>13}")
+    if 'direct' in results:
+        print('(direct passes updates straight to dispatcher: speed of handlers without polling or webhook)')
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Load test of the bot with synthetic conversations')
+    parser.add_argument('--users', type=int, default=20, help='amount of users talking at the same time')
+    parser.add_argument('--rounds', type=int, default=2, help='amount of question/join/suggestion rounds of every user')
+    parser.add_argument('--teams', type=int, default=20, help='amount of teams users can join')
+    parser.add_argument('--think-time', type=float, default=0.0, help='max amount of seconds user waits before next message')
+    parser.add_argument('--ramp-up', type=float, default=0.0, help='amount of seconds during which users start talking')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='amount of seconds stub AXIOM server waits before reply')
+    parser.add_argument('--mode', choices=MODES + ('all',), default='direct', help='how updates get to dispatcher')
+    parser.add_argument('--send-queue', action='store_true', help='send through rate-limited send queue (real Telegram limits)')
+    parser.add_argument('--database', help='connection string of database (temporary SQLite by default)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of random generator')
+    parser.add_argument('--log-file', help='log of the bot (temporary file by default)')
+    parser.add_argument('--json', help='file to write results to (- for stdout)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix='axiom_load_test_') as directory:
+        if args.database is None:
+            args.database = f"sqlite:///{os.path.join(directory, 'load_test.db')}"
+        logging.basicConfig(  # before bot.py is imported, so its logging settings are not applied
+            format='%(asctime)s %(levelname)-8s %(message)s',
+            level=logging.INFO,
+            filename=args.log_file or os.path.join(directory, 'bot.log')
+        )
+        results = asyncio.run(run(args))
+        logging.shutdown()
+
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        for mode_results in results.values():
+            print_report(mode_results)
+        if len(results) > 1:
+            print_comparison(results)
+        if args.json is not None:
+            with open(args.json, 'w') as file:
+                json.dump(results, file, indent=2)
+    failed = any(mode_results['errors'] or any(mode_results['file_loads'].values()) for mode_results in results.values())
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import atexit
+import gzip
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import time
+
+from config import Config
+
+
+FORMAT = '%(asctime)s %(levelname)-8s %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+SAFE_ARGUMENT_TYPES = (str, int, float, bool, type(None))  # immutable, so they can be formatted later by listener thread
+MAX_SAMPLED_MESSAGES = 10000  # counters of sampled messages are reset when there are more messages than this
+
+_listener: logging.handlers.QueueListener = None
+
+
+class CompressingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Rotates log file when it grows over max_bytes or when interval passes (whichever comes first).
+    Rotated files are compressed: bot.log.1.gz is the newest one, bot.log.<backup_count>.gz the oldest one
+    """
+
+    def __init__(self, filename: str, max_bytes: int = 0, interval: float = 0, backup_count: int = 5):
+        """
+        :param max_bytes: max size of log file (0 means no size limit)
+        :param interval: max amount of seconds between two rotations (0 means no time limit)
+        :param backup_count: amount of rotated files that are kept
+        """
+        super().__init__(filename, maxBytes=max_bytes, backupCount=max(backup_count, 1), encoding='utf-8', delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.interval and (time.time() >= self.rollover_at) and os.path.isfile(self.baseFilename) and os.path.getsize(self.baseFilename):
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = time.time() + self.interval
+
+    def rotation_filename(self, default_name: str) -> str:
+        return default_name + '.gz'
+
+    def rotate(self, source: str, dest: str):
+        with open(source, 'rb') as source_file, gzip.open(dest, 'wb') as dest_file:
+            shutil.copyfileobj(source_file, dest_file)
+        os.remove(source)
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records to queue without formatting: the queue is in the same process, so records don't need to be pickled,
+    and message and traceback are formatted by listener thread instead of event loop.
+    Arguments of other types than SAFE_ARGUMENT_TYPES (like models, which columns can't be read from another thread
+    or after session is closed) are converted to strings right away
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if isinstance(record.args, tuple) and not all(isinstance(argument, SAFE_ARGUMENT_TYPES) for argument in record.args):
+            record.args = tuple(argument if isinstance(argument, SAFE_ARGUMENT_TYPES) else str(argument) for argument in record.args)
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes only every n-th record with the same message template for sampled loggers (and their children).
+    Records of WARNING and higher levels always pass
+    """
+
+    def __init__(self, rates: dict):
+        """:param rates: {logger name: n}, for example {'bot_functions': 10} keeps 1 of 10 records"""
+        super().__init__()
+        self.rates = rates
+        self._counts = {}  # {(logger name, message template): amount of records}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if (record.levelno >= logging.WARNING) or (not self.rates):
+            return True
+        rate = self.rate(record.name)
+        if rate <= 1:
+            return True
+
+        if len(self._counts) > MAX_SAMPLED_MESSAGES:
+            self._counts = {}
+        key = (record.name, record.msg)
+        count = self._counts.get(key, 0)
+        self._counts[key] = count + 1
+        return count % rate == 0
+
+    def rate(self, name: str) -> int:
+        """:return sampling rate of logger (rate of the nearest parent if logger has no rate)"""
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition('.')[0]
+        return 1
+
+
+def setup_logging(config: Config) -> bool:
+    """
+    Makes all loggers put records to queue, records are formatted and written to config.json -> logging_file
+    by background thread, so event loop doesn't wait for disk.
+    Like logging.basicConfig, does nothing if root logger already has handlers
+    :return: True if logging was configured
+    """
+    global _listener
+
+    root = logging.getLogger()
+    if root.handlers:
+        return False
+
+    if config.logging_file:
+        handler = CompressingFileHandler(config.logging_file, config.logging_max_bytes, config.logging_rotation_interval, config.logging_backup_count)
+    else:
+        handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(FORMAT, DATE_FORMAT))
+
+    records = queue.SimpleQueue()
+    queue_handler = LocalQueueHandler(records)
+    queue_handler.addFilter(SamplingFilter(dict(config.logging_sampling)))  # dropped records are never formatted
+    root.addHandler(queue_handler)
+    root.setLevel(config.logging_level)
+    for name, level in config.logging_levels:
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+    atexit.register(stop_logging)
+    return True
+
+
+def stop_logging():
+    """Writes records that are still in queue and stops background thread (called automatically on exit)"""
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
@@ -0,0 +1,268 @@
+import bisect
+import logging
+import re
+import time
+
+from aiohttp import web
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ID_PATTERN = re.compile(r'/(\d+|[0-9a-f]{24}|[0-9a-f-]{36})(?=/|$)')  # numeric ids and AXIOM object ids in links
+
+
+class Registry:
+    """Keeps all metrics and renders them in Prometheus text format"""
+
+    def __init__(self):
+        self.metrics = []
+        self.started = time.time()
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        """:return all metrics in Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for suffix, labels, value in metric.samples():
+                lines.append(f'{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    """Base class of metrics, values are kept for every combination of label values"""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), function=None, registry: Registry = REGISTRY):
+        """
+        :param name: metric name like 'bot_handler_seconds'
+        :param documentation: one line description of metric
+        :param labels: names of labels
+        :param function: function() -> float that returns current value (for metrics without labels kept by other objects)
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.function = function
+        self._values = {}  # {(label value, ...): value}
+        registry.register(self)
+
+    def value(self, **labels) -> float:
+        """:return sum of values with given labels"""
+        if self.function is not None:
+            return self.function()
+        return sum(self._matching(labels))
+
+    def samples(self) -> list:
+        """:return [(name suffix, {label: value}, value), ...]"""
+        if self.function is None:
+            return [('', self._labels(key), value) for key, value in self._values.items()]
+        try:
+            return [('', {}, self.function())]
+        except Exception:
+            logging.exception('Metric %s was not read', self.name)
+            return []
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _labels(self, key: tuple) -> dict:
+        return dict(zip(self.labels, key))
+
+    def _matching(self, labels: dict) -> list:
+        """:return values which labels contain all given labels"""
+        if not labels:
+            return list(self._values.values())
+        expected = {label: str(value) for label, value in labels.items()}
+        return [value for key, value in self._values.items() if expected.items() <= self._labels(key).items()]
+
+
+class Counter(Metric):
+    """Value that only increases (amount of events)"""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that goes up and down"""
+
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Distribution of observed values (like durations) in buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS, registry: Registry = REGISTRY):
+        """:param buckets: sorted upper bounds of buckets (+Inf bucket is added automatically)"""
+        super().__init__(name, documentation, labels, registry=registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        data = self._values.get(key)
+        if data is None:
+            data = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]  # [bucket counts, sum, count]
+        data[0][bisect.bisect_left(self.buckets, value)] += 1
+        data[1] += value
+        data[2] += 1
+
+    def count(self, **labels) -> int:
+        """:return amount of observed values with given labels"""
+        return sum(data[2] for data in self._matching(labels))
+
+    def total(self, **labels) -> float:
+        """:return sum of observed values with given labels"""
+        return sum(data[1] for data in self._matching(labels))
+
+    def quantile(self, q: float, **labels) -> float or None:
+        """
+        Estimates quantile from buckets (like histogram_quantile of Prometheus)
+        :param q: float from 0 to 1, like 0.95
+        :return: estimated value or None if nothing was observed
+        """
+        counts = [0] * (len(self.buckets) + 1)
+        for data in self._matching(labels):
+            counts = [total + count for total, count in zip(counts, data[0])]
+        amount = sum(counts)
+        if not amount:
+            return None
+
+        rank, cumulative = q * amount, 0
+        for index, count in enumerate(counts):
+            if count and cumulative + count >= rank:
+                if index == len(self.buckets):  # +Inf bucket
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def label_values(self, label: str) -> set:
+        """:return all values of label that were observed"""
+        index = self.labels.index(label)
+        return {key[index] for key in self._values}
+
+    def samples(self) -> list:
+        samples = []
+        for key, (counts, total, amount) in self._values.items():
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append(('_bucket', {**labels, 'le': bound}, cumulative))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, amount))
+        return samples
+
+
+handler_seconds = Histogram('bot_handler_seconds', 'Time of handling one update', ('handler', 'state'))
+handler_errors = Counter('bot_handler_errors_total', 'Amount of updates which handler raised exception', ('handler', 'state'))
+handlers_in_flight = Gauge('bot_handlers_in_flight', 'Amount of updates that are being handled now', ('handler', 'state'))
+api_seconds = Histogram('axiom_request_seconds', 'Time of AXIOM API requests (including wait for free connection)', ('method', 'link'))
+api_errors = Counter('axiom_request_errors_total', 'Amount of AXIOM API requests that failed', ('method', 'link'))
+db_call_seconds = Histogram('db_call_seconds', 'Time of model calls (including wait for session)', ('function',))
+db_session_seconds = Histogram('db_session_seconds', 'Time from opening to closing of database session', ('result',))
+
+
+def link_template(link: str) -> str:
+    """:return link with ids replaced by {id}, so all requests to one endpoint have the same label"""
+    return ID_PATTERN.sub('/{id}', link.split('?', 1)[0])
+
+
+def summary() -> str:
+    """:return short human readable report of handler, API and database metrics"""
+    def ms(seconds: float or None) -> str:
+        return '—' if seconds is None else f'{seconds * 1000:.0f} мс'
+
+    uptime = int(time.time() - REGISTRY.started)
+    updates = handler_seconds.count()
+    lines = [
+        f'Статистика за {uptime // 3600} ч {uptime % 3600 // 60} мин',
+        f'Обработано обновлений: {updates} ({updates / max(uptime, 1):.2f} в секунду)',
+        f'Ошибок: {handler_errors.value():.0f}, обрабатывается сейчас: {handlers_in_flight.value():.0f}',
+        f'Время обработки: p50 {ms(handler_seconds.quantile(0.5))}, p95 {ms(handler_seconds.quantile(0.95))}'
+    ]
+
+    handlers = sorted(handler_seconds.label_values('handler'), key=lambda name: -handler_seconds.quantile(0.95, handler=name))
+    if handlers:
+        lines.append('Самые медленные обработчики (p95):')
+        for name in handlers[:5]:
+            lines.append(f'  {name}: {ms(handler_seconds.quantile(0.95, handler=name))} ({handler_seconds.count(handler=name)})')
+
+    lines.append(
+        f'AXIOM: {api_seconds.count()} запросов, p95 {ms(api_seconds.quantile(0.95))}, ошибок {api_errors.value():.0f}'
+    )
+    lines.append(
+        f'База данных: {db_call_seconds.count()} вызовов, p95 {ms(db_call_seconds.quantile(0.95))}, '
+        f'сессия p95 {ms(db_session_seconds.quantile(0.95))}'
+    )
+    return '\n'.join(lines)
+
+
+class MetricsServer:
+    """Local HTTP server with /metrics endpoint for Prometheus"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 9100, registry: Registry = REGISTRY):
+        """:param port: port of server (0 disables server)"""
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._runner: web.AppRunner = None
+
+    async def start(self):
+        if self._runner is not None or not self.port:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.info('Metrics are served on http://%s:%s/metrics', self.host, self.port)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.expose(), content_type='text/plain', charset='utf-8')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    pairs = (f'{name}="{_escape(_format_value(value) if name == "le" else value)}"' for name, value in labels.items())
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
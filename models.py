@@ -1,10 +1,33 @@
 import logging
-from datetime import datetime
+import json as json_module
+from datetime import datetime, timedelta
 import contextlib
 
 import sqlalchemy
-from database import SqlAlchemyBase
-from database import create_session
+from database import SqlAlchemyBase, AsyncCalls, AsyncProxy
+from database import create_session, run_async
+
+
+class UserAsyncProxy(AsyncProxy):
+    """Async calls of User that read and write state/cache through User.storage when it's set"""
+
+    async def get(self, user_id: int):
+        if User.storage is None:
+            return await run_async(User.get, user_id)
+        values = await User.storage.get(user_id)
+        return None if values is None else User(id=user_id, state=values[0], cache=values[1])
+
+    async def set(self, state: str = None, cache: str = None):
+        user: User = self._target
+        if User.storage is None:
+            return await run_async(user.set, state, cache)
+        logging.info('Change %s to ["%s", "%s"]', user, state, cache)
+        user.state, user.cache = await User.storage.set(user.id, state, cache)
+
+    async def add(self, user_id: int, state: str = None):
+        await run_async(User.add, user_id, state)
+        if User.storage is not None:
+            await User.storage.forget(user_id)
 
 
 class User(SqlAlchemyBase):
@@ -14,15 +37,19 @@ class User(SqlAlchemyBase):
     state = sqlalchemy.Column(sqlalchemy.TEXT, default='start', nullable=False)
     cache = sqlalchemy.Column(sqlalchemy.TEXT, nullable=True)
 
+    storage = None  # StateStorage that keeps state/cache instead of this table (see state_storage.py), None means this table
+    aio = AsyncCalls(UserAsyncProxy)
+
     def set(self, state: str = None, cache: str = None):
         """
-        Change state/cache. If parameter is None, it won't be changed
+        Change state/cache in users table (user.aio.set changes them in User.storage when it's set).
+        If parameter is None, it won't be changed
         :param state: string that represents state from answers.json
         :param cache: string that store some temporary data
         """
         with contextlib.closing(create_session()) as session:
-            logging.info(f'Change {self} to ["{state}", "{cache}"]')
-            user = session.query(User).filter(User.id == self.id).first()
+            logging.info('Change %s to ["%s", "%s"]', self, state, cache)
+            user = session.get(User, self.id)
 
             if state is not None:
                 self.state = user.state = state
@@ -47,20 +74,42 @@ class User(SqlAlchemyBase):
         :param state: string (or None) that represents state from answers.json
         """
         with contextlib.closing(create_session()) as session:
-            logging.info(f'Add User(id={user_id}, state="{state}") to database')
+            logging.info('Add User(id=%s, state="%s") to database', user_id, state)
             session.add(User(id=user_id, state=state))
+            session.flush()  # new user is read by the same update
             session.commit()
 
     @staticmethod
     def get(user_id: int):
         """
-        Gets User from database by user_id
+        Gets User from users table by user_id (User.aio.get reads User.storage when it's set)
         :param user_id: integer that represents user telegram id
         :return User(**kwargs) by user_id or None if id is invalid
         """
         with contextlib.closing(create_session()) as session:
             return session.query(User).filter(User.id == user_id).first()
 
+    @staticmethod
+    def read_state(user_id: int) -> (str, str) or None:
+        """
+        Reads state and cache from users table (used by User.storage)
+        :param user_id: integer that represents user telegram id
+        :return (state, cache) or None if id is invalid
+        """
+        with contextlib.closing(create_session()) as session:
+            row = session.query(User.state, User.cache).filter(User.id == user_id).first()
+            return None if row is None else (row.state, row.cache)
+
+    @staticmethod
+    def write_states(states: dict):
+        """
+        Writes state and cache of many users to users table at once (used by User.storage)
+        :param states: {user_id: (state, cache)}
+        """
+        with contextlib.closing(create_session()) as session:
+            session.bulk_update_mappings(User, [{'id': user_id, 'state': state, 'cache': cache} for user_id, (state, cache) in states.items()])
+            session.commit()
+
     def __repr__(self):
         return f'User(id={self.id}, state="{self.state}")'
 
@@ -85,8 +134,8 @@ class UserInfo(SqlAlchemyBase):
         :param job: string that represents user's jobs
         """
         with contextlib.closing(create_session()) as session:
-            logging.info(f'Change {self} to ["{name}", "{surname}", "{patronymic}", "{email}", "{job}"]')
-            user_info = session.query(UserInfo).filter(UserInfo.user_id == self.user_id).first()
+            logging.info('Change %s to ["%s", "%s", "%s", "%s", "%s"]', self, name, surname, patronymic, email, job)
+            user_info = session.get(UserInfo, self.user_id)
 
             if name is not None:
                 self.name = user_info.name = name
@@ -107,8 +156,8 @@ class UserInfo(SqlAlchemyBase):
         :param patronymic: string (or None) that represents user's patronymic
         """
         with contextlib.closing(create_session()) as session:
-            logging.info(f'Change users patronymic from {self} to "{patronymic}"')
-            user_info = session.query(UserInfo).filter(UserInfo.user_id == self.user_id).first()
+            logging.info('Change users patronymic from %s to "%s"', self, patronymic)
+            user_info = session.get(UserInfo, self.user_id)
 
             self.patronymic = user_info.patronymic = patronymic
 
@@ -119,14 +168,12 @@ class UserInfo(SqlAlchemyBase):
         Checks if all essential columns are filled
         :return: True id all column are filled, False in any other case
         """
-        with contextlib.closing(create_session()) as session:
-            user_info = session.query(UserInfo).filter(UserInfo.user_id == self.user_id).first()
-            return (
-                    (user_info.name is not None) and
-                    (user_info.surname is not None) and
-                    (user_info.email is not None) and
-                    (user_info.job is not None)
-            )
+        return (
+                (self.name is not None) and
+                (self.surname is not None) and
+                (self.email is not None) and
+                (self.job is not None)
+        )
 
     @staticmethod
     def add(user_id: int):
@@ -135,8 +182,9 @@ class UserInfo(SqlAlchemyBase):
         :param user_id: integer that represents user telegram id
         """
         with contextlib.closing(create_session()) as session:
-            logging.info(f'Add UserInfo(id={user_id}) to database')
+            logging.info('Add UserInfo(id=%s) to database', user_id)
             session.add(UserInfo(user_id=user_id))
+            session.flush()  # new user_info is read by the same update
             session.commit()
 
     @staticmethod
@@ -155,12 +203,16 @@ class UserInfo(SqlAlchemyBase):
 
 class Discussion(SqlAlchemyBase):
     __tablename__ = 'discussions'
+    __table_args__ = (sqlalchemy.Index('ix_discussions_user_id_finished', 'user_id', 'finished'),)
 
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, nullable=False, autoincrement=True)
     server_id = sqlalchemy.Column(sqlalchemy.Integer, unique=True, nullable=True)
     user_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("users.id"), nullable=False)
     theme = sqlalchemy.Column(sqlalchemy.TEXT, nullable=False)
     finished = sqlalchemy.Column(sqlalchemy.Boolean, default=False, nullable=False)
+    last_message_at = sqlalchemy.Column(sqlalchemy.TIMESTAMP, nullable=True)  # maintained by Dialog.add
+    last_question_id = sqlalchemy.Column(sqlalchemy.Integer, nullable=True)  # maintained by Dialog.add
+    message_count = sqlalchemy.Column(sqlalchemy.Integer, default=0, server_default='0', nullable=False)  # maintained by Dialog.add
 
     def set(self, theme: str = None, finished: bool = None, server_id: int = None):
         """
@@ -169,8 +221,8 @@ class Discussion(SqlAlchemyBase):
         :param finished: string that represents discussion's state
         """
         with contextlib.closing(create_session()) as session:
-            logging.info(f'Set discussion {self} to ["{theme}"", {finished}, {server_id}]')
-            discussion = session.query(Discussion).filter(Discussion.id == self.id).first()
+            logging.info('Set discussion %s to ["%s"", %s, %s]', self, theme, finished, server_id)
+            discussion = session.get(Discussion, self.id)
 
             if theme is not None:
                 self.theme = discussion.theme = theme
@@ -184,22 +236,27 @@ class Discussion(SqlAlchemyBase):
     def update(self):
         """Updates self with newest data from database"""
         with contextlib.closing(create_session()) as session:
-            discussion = session.query(Discussion).filter(Discussion.id == self.id).first()
+            discussion = session.query(Discussion).filter(Discussion.id == self.id).populate_existing().first()
 
             self.theme = discussion.theme
             self.finished = discussion.finished
+            self.last_message_at = discussion.last_message_at
+            self.last_question_id = discussion.last_question_id
+            self.message_count = discussion.message_count
 
     def get_last_message(self):
         """:return last Dialog(**kwargs) by self.id or None if zero dialogs are found"""
         with contextlib.closing(create_session()) as session:
-            return session.query(Dialog).filter(Dialog.discussion_id == self.id).all()[-1]
+            return session.query(Dialog).filter(Dialog.discussion_id == self.id).order_by(Dialog.id.desc()).first()
 
     def get_last_question(self):
         """
         :return last Dialog(**kwargs) by self.id AND by dialog.moderator == False or None if zero dialogs are found
         """
+        if self.last_question_id is None:
+            return None
         with contextlib.closing(create_session()) as session:
-            return session.query(Dialog).filter(Dialog.discussion_id == self.id, Dialog.moderator == False).all()[-1]
+            return session.get(Dialog, self.last_question_id)
 
     def get_questions(self):
         """:return [Dialog(**kwargs), Dialog(**kwargs), ...] by self.id AND by dialog.moderator == False or None if zero dialogs are found"""
@@ -221,8 +278,9 @@ class Discussion(SqlAlchemyBase):
         :param theme: string that represents discussion's theme
         """
         with contextlib.closing(create_session()) as session:
-            logging.info(f'Add Discussion(user_id={user_id}, theme="{theme}") to database')
+            logging.info('Add Discussion(user_id=%s, theme="%s") to database', user_id, theme)
             session.add(Discussion(user_id=user_id, theme=theme))
+            session.flush()  # sets discussion.id, which is read by the same update
             session.commit()
 
     @staticmethod
@@ -235,6 +293,19 @@ class Discussion(SqlAlchemyBase):
         with contextlib.closing(create_session()) as session:
             return session.query(Discussion).filter(Discussion.id == discussion_id).first()
 
+    @staticmethod
+    def fill_activity():
+        """Calculates last_message_at/last_question_id/message_count of discussions that were created before these columns"""
+        with contextlib.closing(create_session()) as session:
+            logging.info('Fill last activity of discussions')
+            dialogs = sqlalchemy.orm.aliased(Dialog)
+            session.query(Discussion).filter(Discussion.message_count == 0).update({
+                Discussion.last_message_at: session.query(sqlalchemy.func.max(dialogs.time)).filter(dialogs.discussion_id == Discussion.id).scalar_subquery(),
+                Discussion.last_question_id: session.query(sqlalchemy.func.max(dialogs.id)).filter(dialogs.discussion_id == Discussion.id, dialogs.moderator == False).scalar_subquery(),
+                Discussion.message_count: session.query(sqlalchemy.func.count(dialogs.id)).filter(dialogs.discussion_id == Discussion.id).scalar_subquery()
+            }, synchronize_session=False)
+            session.commit()
+
     @staticmethod
     def get_discussions(user_id: int):
         """
@@ -251,6 +322,10 @@ class Discussion(SqlAlchemyBase):
 
 class Dialog(SqlAlchemyBase):
     __tablename__ = 'dialogs'
+    __table_args__ = (
+        sqlalchemy.Index('ix_dialogs_bot_message_id', 'bot_message_id'),
+        sqlalchemy.Index('ix_dialogs_discussion_id', 'discussion_id')
+    )
 
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, nullable=False, autoincrement=True)
     discussion_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("discussions.id"))
@@ -265,24 +340,33 @@ class Dialog(SqlAlchemyBase):
     @staticmethod
     def add(discussion_id: int, text: str, who: int, message_id: int, bot_message_id: int, server_id: int, moderator: bool = None):
         """
-        Add Dialog message to database
+        Add Dialog message to database (and update last activity of its Discussion)
         :param discussion_id: integer that represents discussion_id
         :param text: string that represents user message
         :param who: integer that represents user telegram id
         :param message_id: integer that represents user message id
         :param bot_message_id: integer that represents bot message id
         :param moderator: bool that represents is this message was from moderator_chat
+        :return Dialog(**kwargs) that was added
         """
         with contextlib.closing(create_session()) as session:
-            logging.info(f'Add new Dialog(discussion_id={discussion_id}, who={who}, moderator={moderator}) to database')
+            logging.info('Add new Dialog(discussion_id=%s, who=%s, moderator=%s) to database', discussion_id, who, moderator)
 
-            session.add(Dialog(
-                discussion_id=discussion_id, text=text, who=who, time=datetime.now(),
+            dialog = Dialog(
+                discussion_id=discussion_id, text=text, who=who, time=datetime.now().replace(microsecond=0),
                 message_id=message_id, bot_message_id=bot_message_id, moderator=moderator,
-                server_id=server_id)
+                server_id=server_id
             )
+            session.add(dialog)
+            session.flush()  # sets dialog.id
+
+            activity = {Discussion.last_message_at: dialog.time, Discussion.message_count: Discussion.message_count + 1}
+            if not moderator:
+                activity[Discussion.last_question_id] = dialog.id
+            session.query(Discussion).filter(Discussion.id == discussion_id).update(activity)
 
             session.commit()
+            return dialog
 
     @staticmethod
     def get_question(bot_message_id: int):
@@ -324,8 +408,8 @@ class Suggestion(SqlAlchemyBase):
         :param text: string that represents user message
         """
         with contextlib.closing(create_session()) as session:
-            logging.info(f'Set discussion {self} to ["{theme}", "{text[:20]}..."]')
-            suggestion = session.query(Suggestion).filter(Suggestion.id == self.id).first()
+            logging.info('Set discussion %s to ["%s", "%s..."]', self, theme, text[:20])
+            suggestion = session.get(Suggestion, self.id)
 
             if theme is not None:
                 self.theme = suggestion.theme = theme
@@ -342,8 +426,9 @@ class Suggestion(SqlAlchemyBase):
         :param theme: string that represents suggestion's theme
         """
         with contextlib.closing(create_session()) as session:
-            logging.info(f'Add Suggestion(user_id={user_id}, theme="{theme}") to database')
+            logging.info('Add Suggestion(user_id=%s, theme="%s") to database', user_id, theme)
             session.add(Suggestion(user_id=user_id, theme=theme, time=datetime.now()))
+            session.flush()  # sets suggestion.id, which is read by the same update
             session.commit()
 
     @staticmethod
@@ -382,8 +467,8 @@ class Team(SqlAlchemyBase):
 
     def set(self, title: str = None, description: str = None, chat_id: int = None):
         with contextlib.closing(create_session()) as session:
-            logging.info(f'Set Team {self} to ["{title}", "{description}", {chat_id}]')
-            team = session.query(Team).filter(Team.id == self.id).first()
+            logging.info('Set Team %s to ["%s", "%s", %s]', self, title, description, chat_id)
+            team = session.get(Team, self.id)
 
             if chat_id is not None:
                 self.chat_id = team.chat_id = chat_id
@@ -401,7 +486,7 @@ class Team(SqlAlchemyBase):
     @staticmethod
     def add(chat_id: int, owner_id: int, competition_id: int):
         with contextlib.closing(create_session()) as session:
-            logging.info(f'Add Team(chat_id={chat_id}, owner_id={owner_id}, competition_id={competition_id}) to database')
+            logging.info('Add Team(chat_id=%s, owner_id=%s, competition_id=%s) to database', chat_id, owner_id, competition_id)
             session.add(Team(chat_id=chat_id, owner_id=owner_id, competition_id=competition_id))
             session.commit()
 
@@ -415,6 +500,21 @@ class Team(SqlAlchemyBase):
         with contextlib.closing(create_session()) as session:
             return session.query(Member).filter(Member.chat_id == chat_id).all()
 
+    @staticmethod
+    def get_joinable_chats(user_id: int, chat_ids: list) -> set:
+        """
+        Finds chats user can send application to: user is not a member and has no application that is waiting or denied
+        :param user_id: integer that represents user telegram id
+        :param chat_ids: [chat_id, ...] of teams to check
+        :return {chat_id, ...} subset of chat_ids
+        """
+        with contextlib.closing(create_session()) as session:
+            applications = {}  # {chat_id: accepted} of the first application to every chat
+            for chat_id, accepted in session.query(Application.chat_id, Application.accepted).filter(Application.user_id == user_id, Application.chat_id.in_(chat_ids)).order_by(Application.id):
+                applications.setdefault(chat_id, accepted)
+            members = {chat_id for chat_id, in session.query(Member.chat_id).filter(Member.user_id == user_id, Member.chat_id.in_(chat_ids))}
+            return {chat_id for chat_id in chat_ids if (applications.get(chat_id, True) is True) and (chat_id not in members)}
+
     @staticmethod
     def get_all_chats():
         with contextlib.closing(create_session()) as session:
@@ -436,6 +536,7 @@ class Team(SqlAlchemyBase):
 
 class Member(SqlAlchemyBase):
     __tablename__ = 'members'
+    __table_args__ = (sqlalchemy.Index('ix_members_chat_id_user_id', 'chat_id', 'user_id'),)
 
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, nullable=False, autoincrement=True)
     chat_id = sqlalchemy.Column(sqlalchemy.BigInteger, sqlalchemy.ForeignKey("teams.chat_id"), nullable=False)
@@ -444,7 +545,7 @@ class Member(SqlAlchemyBase):
     @staticmethod
     def add(chat_id: int, user_id: int):
         with contextlib.closing(create_session()) as session:
-            logging.info(f'Add Member(chat_id={chat_id}, user_id={user_id}) to database')
+            logging.info('Add Member(chat_id=%s, user_id=%s) to database', chat_id, user_id)
             session.add(Member(chat_id=chat_id, user_id=user_id))
             session.commit()
 
@@ -454,6 +555,7 @@ class Member(SqlAlchemyBase):
 
 class Application(SqlAlchemyBase):
     __tablename__ = 'applications'
+    __table_args__ = (sqlalchemy.Index('ix_applications_user_id_chat_id', 'user_id', 'chat_id'),)
 
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, nullable=False, autoincrement=True)
     user_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("users.id"), nullable=False)
@@ -463,15 +565,15 @@ class Application(SqlAlchemyBase):
 
     def set(self, accepted: bool):
         with contextlib.closing(create_session()) as session:
-            logging.info(f'Set Application {self} to [{accepted}]')
-            application = session.query(Application).filter(Application.id == self.id).first()
+            logging.info('Set Application %s to [%s]', self, accepted)
+            application = session.get(Application, self.id)
             self.accepted = application.accepted = accepted
             session.commit()
 
     @staticmethod
     def add(chat_id: int, user_id: int, poll_id: int):
         with contextlib.closing(create_session()) as session:
-            logging.info(f'Add Application(chat_id={chat_id}, user_id={user_id}, poll_id={poll_id}) to database')
+            logging.info('Add Application(chat_id=%s, user_id=%s, poll_id=%s) to database', chat_id, user_id, poll_id)
             session.add(Application(chat_id=chat_id, user_id=user_id, poll_id=poll_id))
             session.commit()
 
@@ -482,3 +584,224 @@ class Application(SqlAlchemyBase):
 
     def __repr__(self):
         return f'Application(chat_id={self.chat_id}, user_id={self.user_id}, accepted={self.accepted})'
+
+
+class Outbox(SqlAlchemyBase):
+    __tablename__ = 'outbox'
+
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, nullable=False, autoincrement=True)
+    key = sqlalchemy.Column(sqlalchemy.String(64), nullable=False, index=True)
+    method = sqlalchemy.Column(sqlalchemy.String(8), nullable=False)
+    link = sqlalchemy.Column(sqlalchemy.TEXT, nullable=False)
+    json = sqlalchemy.Column(sqlalchemy.TEXT, nullable=True)
+    params = sqlalchemy.Column(sqlalchemy.TEXT, nullable=True)
+    time = sqlalchemy.Column(sqlalchemy.TIMESTAMP, nullable=False)
+    attempts = sqlalchemy.Column(sqlalchemy.Integer, default=0, nullable=False)
+    next_attempt = sqlalchemy.Column(sqlalchemy.TIMESTAMP, nullable=False, index=True)
+
+    def delay(self, seconds: float):
+        """
+        Postpones next delivery attempt
+        :param seconds: amount of seconds before next attempt
+        """
+        with contextlib.closing(create_session()) as session:
+            outbox = session.get(Outbox, self.id)
+            self.attempts = outbox.attempts = outbox.attempts + 1
+            self.next_attempt = outbox.next_attempt = datetime.now() + timedelta(seconds=seconds)
+            session.commit()
+
+    def delete(self):
+        with contextlib.closing(create_session()) as session:
+            session.query(Outbox).filter(Outbox.id == self.id).delete()
+            session.commit()
+
+    @staticmethod
+    def add(key: str, method: str, link: str, json: dict = None, params: dict = None):
+        """
+        Add API request to outbox
+        :param key: string, requests with same key are delivered strictly in order they were added
+        :param method: HTTP method of request
+        :param link: API link (without /api/v1)
+        :param json: dict (or None) that represents request body
+        :param params: dict (or None) that represents request query parameters
+        """
+        with contextlib.closing(create_session()) as session:
+            logging.info('Add Outbox(key="%s", method=%s, link="%s") to database', key, method, link)
+            now = datetime.now()
+            session.add(Outbox(
+                key=key, method=method, link=link, time=now, next_attempt=now,
+                json=None if json is None else json_module.dumps(json),
+                params=None if params is None else json_module.dumps(params))
+            )
+            session.commit()
+
+    @staticmethod
+    def get_due(limit: int):
+        """
+        Gets requests that must be delivered now (only the oldest request of every key)
+        :param limit: max amount of requests
+        :return [Outbox(**kwargs), Outbox(**kwargs), ...] or [] if nothing to deliver
+        """
+        with contextlib.closing(create_session()) as session:
+            heads = session.query(sqlalchemy.func.min(Outbox.id)).group_by(Outbox.key)
+            return session.query(Outbox).filter(Outbox.id.in_(heads), Outbox.next_attempt <= datetime.now()).order_by(Outbox.id).limit(limit).all()
+
+    @staticmethod
+    def depth() -> int:
+        """:return amount of requests that are not delivered yet"""
+        with contextlib.closing(create_session()) as session:
+            return session.query(sqlalchemy.func.count(Outbox.id)).scalar()
+
+    @staticmethod
+    def oldest_time():
+        """:return time when the oldest not delivered request was added or None if outbox is empty"""
+        with contextlib.closing(create_session()) as session:
+            return session.query(sqlalchemy.func.min(Outbox.time)).scalar()
+
+    def __repr__(self):
+        return f'Outbox(key="{self.key}", method={self.method}, link="{self.link}", attempts={self.attempts})'
+
+
+class Timer(SqlAlchemyBase):
+    __tablename__ = 'timers'
+    __table_args__ = (sqlalchemy.UniqueConstraint('kind', 'key'),)
+
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, nullable=False, autoincrement=True)
+    kind = sqlalchemy.Column(sqlalchemy.String(32), nullable=False)
+    key = sqlalchemy.Column(sqlalchemy.String(64), nullable=False)
+    deadline = sqlalchemy.Column(sqlalchemy.TIMESTAMP, nullable=False, index=True)
+    payload = sqlalchemy.Column(sqlalchemy.TEXT, nullable=False)
+    attempts = sqlalchemy.Column(sqlalchemy.Integer, default=0, server_default='0', nullable=False)  # failed callbacks since deadline was set
+
+    def delete(self):
+        """Deletes timer if its deadline was not moved"""
+        with contextlib.closing(create_session()) as session:
+            session.query(Timer).filter(Timer.id == self.id, Timer.deadline == self.deadline).delete()
+            session.commit()
+
+    def postpone(self, deadline: datetime) -> bool:
+        """
+        Moves deadline of timer which callback failed and counts failed attempt (if its deadline was not moved meanwhile)
+        :param deadline: datetime of next attempt
+        :return: True if timer was postponed
+        """
+        with contextlib.closing(create_session()) as session:
+            postponed = session.query(Timer).filter(Timer.id == self.id, Timer.deadline == self.deadline).update(
+                {Timer.deadline: deadline, Timer.attempts: Timer.attempts + 1}, synchronize_session=False
+            )
+            session.commit()
+            return bool(postponed)
+
+    @staticmethod
+    def set(kind: str, key: str, deadline: datetime, payload: dict):
+        """
+        Add timer to database or move deadline of existing one
+        :param kind: string that represents what timer does
+        :param key: string that represents object of timer (only one timer of every kind per key)
+        :param deadline: datetime when timer fires
+        :param payload: dict that will be passed to timer callback
+        """
+        with contextlib.closing(create_session()) as session:
+            logging.info('Set Timer(kind="%s", key="%s") to %s', kind, key, deadline)
+            timer = session.query(Timer).filter(Timer.kind == kind, Timer.key == key).first()
+            if timer is None:
+                session.add(Timer(kind=kind, key=key, deadline=deadline, payload=json_module.dumps(payload)))
+            else:
+                timer.deadline = deadline
+                timer.payload = json_module.dumps(payload)
+                timer.attempts = 0
+            session.commit()
+
+    @staticmethod
+    def get_due(limit: int):
+        """
+        Gets timers which deadline has come
+        :param limit: max amount of timers
+        :return [Timer(**kwargs), Timer(**kwargs), ...] or [] if zero timers are found
+        """
+        with contextlib.closing(create_session()) as session:
+            return session.query(Timer).filter(Timer.deadline <= datetime.now()).order_by(Timer.deadline).limit(limit).all()
+
+    @staticmethod
+    def get_deadlines():
+        """:return [(kind, key, deadline), ...] of all timers"""
+        with contextlib.closing(create_session()) as session:
+            return session.query(Timer.kind, Timer.key, Timer.deadline).all()
+
+    def __repr__(self):
+        return f'Timer(kind="{self.kind}", key="{self.key}", deadline={self.deadline})'
+
+
+class Broadcast(SqlAlchemyBase):
+    __tablename__ = 'broadcasts'
+
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, nullable=False, autoincrement=True)
+    competition_id = sqlalchemy.Column(sqlalchemy.Integer, nullable=True)  # None means all registered users
+    text = sqlalchemy.Column(sqlalchemy.TEXT, nullable=False)
+    time = sqlalchemy.Column(sqlalchemy.TIMESTAMP, nullable=False)
+    last_user_id = sqlalchemy.Column(sqlalchemy.Integer, default=0, nullable=False)  # recipients are processed in user_id order
+    sent = sqlalchemy.Column(sqlalchemy.Integer, default=0, nullable=False)
+    failed = sqlalchemy.Column(sqlalchemy.Integer, default=0, nullable=False)
+    blocked = sqlalchemy.Column(sqlalchemy.Integer, default=0, nullable=False)
+    finished = sqlalchemy.Column(sqlalchemy.Boolean, default=False, nullable=False, index=True)
+
+    def checkpoint(self, last_user_id: int, sent: int, failed: int, blocked: int, finished: bool = False):
+        """
+        Saves progress of broadcast
+        :param last_user_id: integer that represents telegram id of the last processed recipient
+        :param sent: amount of delivered messages
+        :param failed: amount of messages that were not delivered
+        :param blocked: amount of recipients that blocked bot (or deleted account)
+        :param finished: True when all recipients are processed
+        """
+        with contextlib.closing(create_session()) as session:
+            broadcast = session.get(Broadcast, self.id)
+            self.last_user_id = broadcast.last_user_id = last_user_id
+            self.sent = broadcast.sent = sent
+            self.failed = broadcast.failed = failed
+            self.blocked = broadcast.blocked = blocked
+            self.finished = broadcast.finished = finished
+            session.commit()
+
+    def get_recipients(self, limit: int) -> list:
+        """
+        Gets next recipients after self.last_user_id (all registered users or members and owners of competition teams)
+        :param limit: max amount of recipients
+        :return [user_id, ...] in ascending order or [] if all recipients are processed
+        """
+        with contextlib.closing(create_session()) as session:
+            if self.competition_id is None:
+                recipients = session.query(UserInfo.user_id.label('user_id')).filter(
+                    UserInfo.name != None, UserInfo.surname != None, UserInfo.email != None, UserInfo.job != None
+                )
+            else:
+                members = session.query(Member.user_id.label('user_id')).join(Team, Team.chat_id == Member.chat_id).filter(Team.competition_id == self.competition_id)
+                owners = session.query(Team.owner_id.label('user_id')).filter(Team.competition_id == self.competition_id)
+                recipients = members.union(owners)
+            recipients = recipients.subquery()
+            query = session.query(recipients.c.user_id).filter(recipients.c.user_id > self.last_user_id)
+            return [user_id for user_id, in query.order_by(recipients.c.user_id).limit(limit)]
+
+    @staticmethod
+    def add(text: str, competition_id: int = None):
+        """
+        Add Broadcast to database
+        :param text: string that represents message for recipients
+        :param competition_id: integer (or None for all registered users) that represents competition id
+        :return Broadcast(**kwargs) that was added
+        """
+        with contextlib.closing(create_session()) as session:
+            logging.info('Add Broadcast(competition_id=%s) to database', competition_id)
+            broadcast = Broadcast(text=text, competition_id=competition_id, time=datetime.now(), last_user_id=0, sent=0, failed=0, blocked=0, finished=False)
+            session.add(broadcast)
+            session.commit()
+            return broadcast
+
+    @staticmethod
+    def get_unfinished():
+        """:return [Broadcast(**kwargs), ...] that were interrupted or [] if zero broadcasts are found"""
+        with contextlib.closing(create_session()) as session:
+            return session.query(Broadcast).filter(Broadcast.finished == False).order_by(Broadcast.id).all()
+
+    def __repr__(self):
+        return f'Broadcast(id={self.id}, competition_id={self.competition_id}, sent={self.sent}, finished={self.finished})'
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import logging
+from datetime import datetime
+
+import api_v1 as api
+from models import Outbox
+
+
+class OutboxWorker:
+    """
+    Background task that delivers requests from Outbox table to AXIOM server.
+    Requests with same key are delivered in order, failed deliveries are retried with exponential backoff
+    """
+
+    def __init__(self, batch_size: int = 50, interval: float = 1.0, retry_delay: float = 5.0, max_retry_delay: float = 600.0):
+        """
+        :param batch_size: max amount of requests that are taken from database and sent at once
+        :param interval: amount of seconds between checks when outbox has nothing to deliver
+        :param retry_delay: amount of seconds before first retry (doubles after every failed attempt)
+        :param max_retry_delay: max amount of seconds between two retries
+        """
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.delivered = 0  # amount of delivered requests
+        self.failed = 0  # amount of failed attempts
+        self.lag = 0.0  # seconds between adding and delivering of the last delivered request
+        self._task: asyncio.Task = None
+
+    def start(self):
+        """Starts worker in background"""
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self.run())
+
+    async def stop(self):
+        """Stops worker (requests that are not delivered stay in database)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self):
+        """Delivers requests forever"""
+        while True:
+            try:
+                delivered = await self.deliver_batch()
+            except Exception:
+                logging.exception('Outbox delivery failed')
+                delivered = 0
+            if delivered == 0:  # nothing to deliver now, otherwise continue without sleeping
+                await asyncio.sleep(self.interval)
+
+    async def deliver_batch(self) -> int:
+        """
+        Sends requests that must be delivered now (requests with different keys are sent concurrently)
+        :return: amount of requests that were sent
+        """
+        batch = await Outbox.aio.get_due(self.batch_size)
+        await asyncio.gather(*(self.deliver(outbox) for outbox in batch))
+        return len(batch)
+
+    async def deliver(self, outbox: Outbox):
+        """Sends one request and removes it from outbox (or postpones it if server is unavailable)"""
+        try:
+            response = await api.request(
+                outbox.method, outbox.link,
+                json=None if outbox.json is None else json.loads(outbox.json),
+                params=None if outbox.params is None else json.loads(outbox.params)
+            )
+        except api.ApiUnavailable as error:
+            self.failed += 1
+            delay = min(self.max_retry_delay, self.retry_delay * 2 ** outbox.attempts)
+            logging.warning('%s not delivered (%s), next attempt in %s seconds', outbox, error, delay)
+            await outbox.aio.delay(delay)
+            return
+
+        if not response.get('success'):  # server rejected request, sending it again won't help
+            logging.error('%s rejected by server: %s', outbox, response.get("error"))
+        await outbox.aio.delete()
+        api.invalidate_after(outbox.link)
+        self.delivered += 1
+        self.lag = (datetime.now() - outbox.time).total_seconds()
+
+    async def metrics(self) -> dict:
+        """:return outbox depth (requests waiting for delivery), delivery lag and counters"""
+        oldest = await Outbox.aio.oldest_time()
+        return {
+            'depth': await Outbox.aio.depth(),
+            'oldest_age': 0.0 if oldest is None else (datetime.now() - oldest).total_seconds(),
+            'lag': self.lag,
+            'delivered': self.delivered,
+            'failed': self.failed
+        }
@@ -0,0 +1,96 @@
+import functools
+
+from answers import get_answers
+
+
+MAX_UNKNOWN_STATES = 1024  # amount of states that are not in answers.json which routes are kept (least recently used are forgotten)
+
+
+class StateRouter:
+    """
+    Routes updates to menu handlers by User.state.
+    Every state from answers.json is mapped to its handlers once (and again after answers.json reload),
+    so routing of one update is a single dict lookup. Other states (they can contain data of users) are kept in
+    bounded LRU cache, so they don't fill memory
+    """
+
+    def __init__(self):
+        self.menus = []  # [(is_menu(state) -> bool, {'message': handler, 'callback_query': handler}), ...] in priority order
+        self._table = {}  # {state: {'message': handler, 'callback_query': handler}} of states from answers.json
+        self._unknown = functools.lru_cache(maxsize=MAX_UNKNOWN_STATES)(self._route)  # the same for other states
+        self._version = None  # answers.json version of self._table
+        self.routes = {}  # {dispatcher handler: (update_type, default handler)} of handlers that pass updates to menus
+
+    def message_handler(self, is_menu):
+        """Decorator that registers message handler for states where is_menu(state) is True"""
+        def decorator(handler):
+            self.register(is_menu, 'message', handler)
+            return handler
+        return decorator
+
+    def callback_query_handler(self, is_menu):
+        """Decorator that registers callback query handler for states where is_menu(state) is True"""
+        def decorator(handler):
+            self.register(is_menu, 'callback_query', handler)
+            return handler
+        return decorator
+
+    def route(self, update_type: str, default):
+        """
+        Decorator that marks dispatcher handler which passes updates to menu handlers (used to name real handler in metrics)
+        :param update_type: 'message' or 'callback_query'
+        :param default: handler for states without menu handler
+        """
+        def decorator(handler):
+            self.routes[handler] = (update_type, default)
+            return handler
+        return decorator
+
+    def register(self, is_menu, update_type: str, handler):
+        """
+        Add handler to menu (menus are checked in registration order)
+        :param is_menu: function(state: str) -> bool
+        :param update_type: 'message' or 'callback_query'
+        :param handler: async function that handles update
+        """
+        for menu_is, handlers in self.menus:
+            if menu_is is is_menu:
+                handlers[update_type] = handler
+                break
+        else:
+            self.menus.append((is_menu, {update_type: handler}))
+        self._version = None  # table must be rebuilt
+
+    def resolve(self, state: str, update_type: str):
+        """
+        :param state: string that represents state from answers.json
+        :param update_type: 'message' or 'callback_query'
+        :return: handler for update_type in state or None if state has no special handler
+        """
+        answers = get_answers()
+        if self._version != answers.version:
+            self._table = {answers_state: self._route(answers_state) for answers_state in answers.states}
+            self._unknown = functools.lru_cache(maxsize=MAX_UNKNOWN_STATES)(self._route)
+            self._version = answers.version
+
+        handlers = self._table.get(state)
+        if handlers is None:  # state is not in answers.json
+            handlers = self._unknown(state)
+        return handlers.get(update_type)
+
+    def real_handler(self, handler, state: str):
+        """:return menu handler that gets update if handler is marked by StateRouter.route, otherwise handler itself"""
+        route = self.routes.get(handler)
+        if route is None:
+            return handler
+        update_type, default = route
+        return self.resolve(state, update_type) or default
+
+    def _route(self, state: str) -> dict:
+        """Finds first matching menu handler for every update type of state"""
+        handlers = {}
+        for is_menu, menu_handlers in self.menus:
+            if is_menu(state):
+                for update_type, handler in menu_handlers.items():
+                    handlers.setdefault(update_type, handler)
+        return handlers
@@ -0,0 +1,152 @@
+import asyncio
+import heapq
+import json
+import logging
+from datetime import datetime, timedelta
+
+from database import UnitOfWork
+from models import Timer
+
+
+class Scheduler:
+    """
+    Runs delayed callbacks from one background task.
+    Deadlines are stored in Timer table (so they survive restarts) and in a heap that tells when to wake up.
+    There is only one deadline per (kind, key): scheduling it again moves the deadline.
+    Timers which callback failed are retried with exponential backoff
+    """
+
+    def __init__(self, batch_size: int = 100, retry_delay: float = 5.0, max_retry_delay: float = 600.0):
+        """
+        :param batch_size: max amount of timers that are taken from database and fired at once
+        :param retry_delay: amount of seconds before first retry of failed callback (doubles after every failed attempt)
+        :param max_retry_delay: max amount of seconds between two retries
+        """
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.callbacks = {}  # {kind: async function(**payload)}
+        self._heap = []  # [(deadline, kind, key), ...], entries with moved deadlines are skipped
+        self._deadlines = {}  # {(kind, key): deadline}
+        self._wakeup: asyncio.Event = None
+        self._task: asyncio.Task = None
+
+    def register(self, kind: str, callback):
+        """
+        Sets callback for timers of kind
+        :param kind: string that represents what timer does
+        :param callback: async function that gets timer payload as keyword arguments
+        """
+        self.callbacks[kind] = callback
+
+    async def schedule(self, kind: str, key, deadline: datetime, **payload):
+        """
+        Sets (or moves) deadline of timer
+        :param kind: string that represents what timer does
+        :param key: object of timer (only one timer of every kind per key)
+        :param deadline: datetime when callback must be called (without microseconds, like it is stored in database)
+        :param payload: keyword arguments for callback (must be json serializable)
+        """
+        key = str(key)
+        deadline = deadline.replace(microsecond=0)  # TIMESTAMP column may round fraction up, heap must not be earlier
+        await Timer.aio.set(kind, key, deadline, payload)
+        self._push(kind, key, deadline)
+
+    async def start(self):
+        """Loads deadlines from database and starts scheduler in background"""
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        for kind, key, deadline in await Timer.aio.get_deadlines():
+            self._push(kind, key, deadline)
+        logging.info('Scheduler recovered %s timers', len(self._deadlines))
+        self._task = asyncio.get_event_loop().create_task(self.run())
+
+    async def stop(self):
+        """Stops scheduler (timers stay in database)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self):
+        """Fires timers forever"""
+        while True:
+            self._wakeup.clear()
+            timeout = None if not self._heap else (self._heap[0][0] - datetime.now()).total_seconds()
+            if (timeout is None) or (timeout > 0):
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                fired = await self.fire_due()
+            except Exception:
+                logging.exception('Scheduler failed to fire timers')
+                await asyncio.sleep(1)
+                continue
+            self._pop_handled()
+            if (fired == 0) and self._heap and (self._heap[0][0] <= datetime.now()):
+                await self._reload()  # deadline in heap doesn't match database, database is right
+
+    async def fire_due(self) -> int:
+        """
+        Calls callbacks of timers which deadline has come (concurrently)
+        :return: amount of fired timers
+        """
+        timers = await Timer.aio.get_due(self.batch_size)
+        await asyncio.gather(*(self.fire(timer) for timer in timers))
+        return len(timers)
+
+    async def fire(self, timer: Timer):
+        """
+        Calls callback of timer (all its changes are committed at once) and deletes timer.
+        If callback failed, its changes are rolled back and timer is postponed
+        """
+        callback = self.callbacks.get(timer.kind)
+        unit_of_work = UnitOfWork.begin()
+        try:
+            if callback is None:
+                logging.error('No callback for %s', timer)
+            else:
+                await callback(**json.loads(timer.payload))
+            await unit_of_work.finish()
+        except Exception:
+            await unit_of_work.finish(success=False)
+            delay = min(self.max_retry_delay, self.retry_delay * 2 ** timer.attempts)
+            logging.exception('%s callback failed, next attempt in %s seconds', timer, delay)
+            deadline = (datetime.now() + timedelta(seconds=delay)).replace(microsecond=0)
+            if await timer.aio.postpone(deadline):
+                self._push(timer.kind, timer.key, deadline)
+            return
+        await timer.aio.delete()
+        self._forget(timer.kind, timer.key, timer.deadline)
+
+    def _push(self, kind: str, key: str, deadline: datetime):
+        """Adds deadline to heap and wakes scheduler up if this deadline is the nearest one"""
+        self._deadlines[(kind, key)] = deadline
+        heapq.heappush(self._heap, (deadline, kind, key))
+        if (self._wakeup is not None) and (self._heap[0][0] == deadline):
+            self._wakeup.set()
+
+    def _forget(self, kind: str, key: str, deadline: datetime):
+        """Marks deadline as fired (unless it was moved while callback was running)"""
+        if self._deadlines.get((kind, key)) == deadline:
+            del self._deadlines[(kind, key)]
+
+    def _pop_handled(self):
+        """Removes fired and moved deadlines from the top of heap"""
+        while self._heap and self._deadlines.get(self._heap[0][1:]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    async def _reload(self):
+        """Replaces heap with deadlines from database"""
+        deadlines = await Timer.aio.get_deadlines()
+        self._heap, self._deadlines = [], {}
+        for kind, key, deadline in deadlines:
+            self._push(kind, key, deadline)
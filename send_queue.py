@@ -0,0 +1,251 @@
+import asyncio
+import bisect
+import functools
+import itertools
+import logging
+import time
+from contextvars import ContextVar
+
+from aiogram import Bot
+from aiogram.bot.api import Methods
+from aiogram.utils.exceptions import RetryAfter
+
+from config import get_config
+
+
+HIGH_PRIORITY = 0  # replies in private chats
+LOW_PRIORITY = 1  # messages in group chats (moderator_chat, admin_chat, team chats)
+BULK_PRIORITY = 2  # broadcasts
+BURST = 3  # amount of messages that can be sent to one chat at once before rate limit starts to work
+MAX_CHAT_BUCKETS = 10000  # idle buckets are removed when there are more buckets than this
+
+QUEUED_METHODS = frozenset({
+    Methods.SEND_MESSAGE, Methods.EDIT_MESSAGE_TEXT, Methods.SEND_POLL, Methods.STOP_POLL,
+    Methods.CREATE_CHAT_INVITE_LINK, Methods.SET_CHAT_TITLE, Methods.SET_CHAT_DESCRIPTION,
+    Methods.FORWARD_MESSAGE, Methods.COPY_MESSAGE, Methods.SEND_PHOTO, Methods.SEND_DOCUMENT
+})
+
+_priority: ContextVar = ContextVar('send_priority', default=None)
+
+
+class TokenBucket:
+    """Allows `rate` actions per second with bursts up to `capacity` actions"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # set by Telegram flood control
+
+    def delay(self, now: float) -> float:
+        """:return: amount of seconds before next action is allowed"""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, seconds: float, now: float):
+        """Forbids actions for seconds"""
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def idle(self, now: float) -> bool:
+        """:return: True if bucket is full, so it is the same as new one"""
+        self._refill(now)
+        return (self.tokens >= self.capacity) and (self.blocked_until <= now)
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class QueuedCall:
+    """Telegram API call waiting in SendQueue"""
+
+    def __init__(self, chat_id, call, future: asyncio.Future):
+        self.chat_id = chat_id
+        self.call = call
+        self.future = future
+        self.queued = time.monotonic()
+        self.attempts = 0
+
+
+class SendQueue:
+    """
+    Sends Telegram API calls respecting global and per chat rate limits (see config.json -> telegram_*_rate).
+    Calls are sent in priority order. Calls to one chat are sent one at a time (the next one starts when the previous
+    one is answered), so calls of the same priority to one chat reach Telegram in order they were submitted.
+    Calls rejected by flood control (RetryAfter) are retried after the time Telegram asked to wait
+    """
+
+    def __init__(self, max_attempts: int = 3):
+        """:param max_attempts: max amount of attempts for one call (RetryAfter is raised after the last one)"""
+        self.max_attempts = max_attempts
+        self.sent = 0  # amount of successful calls
+        self.dispatched = 0  # amount of attempts (including rejected by flood control)
+        self.retried = 0  # amount of calls rejected by flood control
+        self.wait_time = 0.0  # total amount of seconds sent calls waited in queue
+        self.max_wait_time = 0.0
+        self._items = []  # [(priority, sequence number, QueuedCall), ...] sorted
+        self._sequence = itertools.count()
+        self._global_bucket: TokenBucket = None
+        self._chat_buckets = {}  # {chat_id: TokenBucket}
+        self._sending = set()  # chat ids which call is being sent now
+        self._wakeup: asyncio.Event = None
+        self._task: asyncio.Task = None
+
+    async def submit(self, chat_id, priority: int, call):
+        """
+        Queues call and waits until it is sent
+        :param chat_id: id of chat the call sends to
+        :param priority: HIGH_PRIORITY or LOW_PRIORITY
+        :param call: async function without arguments that makes API call
+        :return: result of call
+        """
+        self.start()
+        item = QueuedCall(chat_id, call, asyncio.get_event_loop().create_future())
+        bisect.insort(self._items, (priority, next(self._sequence), item))
+        self._wakeup.set()
+        return await item.future
+
+    def start(self):
+        """Starts sending in background"""
+        if self._task is None:
+            config = get_config()
+            self._global_bucket = TokenBucket(config.telegram_global_rate, config.telegram_global_rate)
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_event_loop().create_task(self.run())
+
+    async def stop(self):
+        """Stops sending (calls that are still in queue fail with CancelledError)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for priority, sequence, item in self._items:
+            item.future.cancel()
+        self._items = []
+
+    async def run(self):
+        """Sends calls forever"""
+        while True:
+            self._wakeup.clear()
+            delay = self.send_ready()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def send_ready(self) -> float or None:
+        """
+        Starts all calls that are allowed by rate limits now
+        :return: amount of seconds before next call is allowed or None if queue is empty
+        """
+        now = time.monotonic()
+        delay = None
+        waiting_chats = set()  # chats which first call can't be sent now (so the next ones too)
+        remaining = []
+        for priority, sequence, item in self._items:
+            if (item.chat_id in waiting_chats) or (item.chat_id in self._sending):
+                remaining.append((priority, sequence, item))
+                continue
+            wait = max(self._global_bucket.delay(now), self._chat_bucket(item.chat_id).delay(now))
+            if wait > 0:
+                waiting_chats.add(item.chat_id)
+                delay = wait if delay is None else min(delay, wait)
+                remaining.append((priority, sequence, item))
+                continue
+
+            self._global_bucket.take(now)
+            self._chat_bucket(item.chat_id).take(now)
+            self.dispatched += 1
+            waited = now - item.queued
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+            self._sending.add(item.chat_id)
+            asyncio.get_event_loop().create_task(self._send(priority, sequence, item))
+        self._items = remaining
+
+        if len(self._chat_buckets) > MAX_CHAT_BUCKETS:
+            self._chat_buckets = {chat_id: bucket for chat_id, bucket in self._chat_buckets.items() if not bucket.idle(now)}
+        return delay
+
+    def metrics(self) -> dict:
+        """:return queue depth and wait time of sent calls"""
+        return {
+            'depth': len(self._items),
+            'sent': self.sent,
+            'retried': self.retried,
+            'average_wait_time': self.wait_time / self.dispatched if self.dispatched else 0.0,
+            'max_wait_time': self.max_wait_time
+        }
+
+    async def _send(self, priority: int, sequence: int, item: QueuedCall):
+        """Makes call and passes its result to submitter (or queues it again if flood control rejected it)"""
+        item.attempts += 1
+        try:
+            result = await item.call()
+        except RetryAfter as error:
+            self.retried += 1
+            logging.warning('Flood control in chat %s, retry in %s seconds', item.chat_id, error.timeout)
+            self._chat_bucket(item.chat_id).block(error.timeout, time.monotonic())
+            if item.attempts < self.max_attempts:
+                bisect.insort(self._items, (priority, sequence, item))  # same place in queue
+                self._wakeup.set()
+            elif not item.future.done():
+                item.future.set_exception(error)
+        except Exception as error:
+            if not item.future.done():
+                item.future.set_exception(error)
+        else:
+            self.sent += 1
+            if not item.future.done():
+                item.future.set_result(result)
+        finally:
+            self._sending.discard(item.chat_id)  # next call to this chat can be sent
+            self._wakeup.set()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            config = get_config()
+            if is_private_chat(chat_id):
+                bucket = TokenBucket(config.telegram_private_rate, BURST)
+            else:
+                bucket = TokenBucket(config.telegram_group_rate / 60, BURST)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+
+def set_priority(priority: int or None):
+    """Sets priority of all calls made by current task (None means priority depends on chat)"""
+    _priority.set(priority)
+
+
+def is_private_chat(chat_id) -> bool:
+    """Private chats have positive ids, groups and channels have negative ids (or @username)"""
+    return isinstance(chat_id, int) and chat_id > 0
+
+
+class QueuedBot(Bot):
+    """Bot which sending methods go through SendQueue (replies in private chats are sent first)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.send_queue = SendQueue()
+
+    async def request(self, method: str, data: dict = None, files: dict = None, **kwargs):
+        if (method not in QUEUED_METHODS) or (data is None) or (data.get('chat_id') is None):
+            return await super().request(method, data, files, **kwargs)
+
+        chat_id = data['chat_id']
+        priority = _priority.get()
+        if priority is None:
+            priority = HIGH_PRIORITY if is_private_chat(chat_id) else LOW_PRIORITY
+        return await self.send_queue.submit(chat_id, priority, functools.partial(super().request, method, data, files, **kwargs))
@@ -0,0 +1,223 @@
+import abc
+import asyncio
+import logging
+from collections import OrderedDict
+
+from models import User
+
+
+class UserNotFound(LookupError):
+    """Raised when state is changed for user that is not in users table"""
+
+
+class StateStorage(abc.ABC):
+    """
+    Keeps User.state and User.cache instead of users table (rows of users table are still added for every user).
+    Changed values are written to users table in background by StateFlusher.
+    Methods are async, so storages that talk to other servers don't block event loop (User.aio calls use them)
+    """
+
+    @abc.abstractmethod
+    async def get(self, user_id: int) -> (str, str) or None:
+        """:return (state, cache) of user or None if user is not in database"""
+
+    @abc.abstractmethod
+    async def set(self, user_id: int, state: str = None, cache: str = None) -> (str, str):
+        """
+        Changes state/cache. If parameter is None, it won't be changed
+        :return new (state, cache) of user
+        :raise UserNotFound: if user is not in database (User.add must be called first)
+        """
+
+    @abc.abstractmethod
+    async def forget(self, user_id: int):
+        """Removes user from storage (next get reads users table)"""
+
+    @abc.abstractmethod
+    async def flush(self) -> int:
+        """
+        Writes changed values to users table
+        :return: amount of written users
+        """
+
+    async def close(self):
+        """Closes connections of storage"""
+
+    async def _existing(self, user_id: int) -> (str, str):
+        """:return (state, cache) of user for StateStorage.set"""
+        values = await self.get(user_id)
+        if values is None:
+            raise UserNotFound(f'User {user_id} is not in database, its state can\'t be changed')
+        return values
+
+
+class MemoryStateStorage(StateStorage):
+    """Keeps states of recently active users in memory of this process (can't be shared by many bot processes)"""
+
+    def __init__(self, capacity: int = 10000):
+        """:param capacity: max amount of users kept in memory (least recently used are removed)"""
+        self.capacity = capacity
+        self._states = OrderedDict()  # {user_id: (state, cache)} in order of use
+        self._changed = {}  # {user_id: (state, cache)} that are not written to users table yet
+
+    async def get(self, user_id: int) -> (str, str) or None:
+        if user_id in self._states:
+            self._states.move_to_end(user_id)
+            return self._states[user_id]
+        values = self._changed.get(user_id) or await User.aio.read_state(user_id)
+        if values is not None:
+            self._remember(user_id, values)
+        return values
+
+    async def set(self, user_id: int, state: str = None, cache: str = None) -> (str, str):
+        old_state, old_cache = await self._existing(user_id)
+        values = (old_state if state is None else state, old_cache if cache is None else cache)
+        self._remember(user_id, values)
+        self._changed[user_id] = values
+        return values
+
+    async def forget(self, user_id: int):
+        self._states.pop(user_id, None)
+        self._changed.pop(user_id, None)
+
+    async def flush(self) -> int:
+        changed, self._changed = self._changed, {}
+        if not changed:
+            return 0
+        try:
+            await User.aio.write_states(changed)
+        except Exception:
+            self._changed = {**changed, **self._changed}  # values changed while writing are newer
+            raise
+        return len(changed)
+
+    def _remember(self, user_id: int, values: (str, str)):
+        self._states[user_id] = values
+        self._states.move_to_end(user_id)
+        while len(self._states) > self.capacity:
+            self._states.popitem(last=False)
+
+
+class RedisStateStorage(StateStorage):
+    """
+    Keeps states in Redis (or any server that speaks Redis protocol), so many bot processes share them.
+    Every user is a hash 'user_state:<id>', ids of users that are not written to users table are in set 'user_state:changed'
+    """
+
+    KEY = 'user_state:{}'
+    CHANGED_KEY = 'user_state:changed'
+
+    def __init__(self, url: str, flush_size: int = 500):
+        """
+        :param url: Redis url like 'redis://localhost:6379/0'
+        :param flush_size: max amount of users written to users table at once
+        """
+        import redis.asyncio as redis  # optional dependency, needed only for this storage
+
+        self.flush_size = flush_size
+        self._redis = redis.Redis.from_url(url, socket_timeout=1, decode_responses=True)
+
+    async def get(self, user_id: int) -> (str, str) or None:
+        state, cache = await self._redis.hmget(self.KEY.format(user_id), 'state', 'cache')
+        if state is not None:
+            return state, cache
+        values = await User.aio.read_state(user_id)
+        if values is not None:
+            await self._redis.hset(self.KEY.format(user_id), mapping=self._mapping(*values))
+        return values
+
+    async def set(self, user_id: int, state: str = None, cache: str = None) -> (str, str):
+        old_state, old_cache = await self._existing(user_id)
+        values = (old_state if state is None else state, old_cache if cache is None else cache)
+        pipeline = self._redis.pipeline()
+        pipeline.hset(self.KEY.format(user_id), mapping=self._mapping(*values))
+        pipeline.sadd(self.CHANGED_KEY, user_id)
+        await pipeline.execute()
+        return values
+
+    async def forget(self, user_id: int):
+        pipeline = self._redis.pipeline()
+        pipeline.delete(self.KEY.format(user_id))
+        pipeline.srem(self.CHANGED_KEY, user_id)
+        await pipeline.execute()
+
+    async def flush(self) -> int:
+        user_ids = [int(user_id) for user_id in await self._redis.spop(self.CHANGED_KEY, self.flush_size) or []]
+        if not user_ids:
+            return 0
+        pipeline = self._redis.pipeline()
+        for user_id in user_ids:
+            pipeline.hmget(self.KEY.format(user_id), 'state', 'cache')
+        changed = {user_id: (state, cache) for user_id, (state, cache) in zip(user_ids, await pipeline.execute()) if state is not None}
+        try:
+            await User.aio.write_states(changed)
+        except Exception:
+            await self._redis.sadd(self.CHANGED_KEY, *user_ids)
+            raise
+        return len(changed)
+
+    async def close(self):
+        await self._redis.aclose()
+
+    @staticmethod
+    def _mapping(state: str, cache: str or None) -> dict:
+        """Redis can't keep None, so cache field is not set when cache is None"""
+        return {'state': state} if cache is None else {'state': state, 'cache': cache}
+
+
+class StateFlusher:
+    """Background task that writes changed states from User.storage to users table"""
+
+    def __init__(self, interval: float = 5.0):
+        """:param interval: amount of seconds between two writes"""
+        self.interval = interval
+        self._task: asyncio.Task = None
+
+    def start(self):
+        """Starts flusher in background (does nothing if states are kept in users table)"""
+        if (self._task is None) and (User.storage is not None):
+            self._task = asyncio.get_event_loop().create_task(self.run())
+
+    async def stop(self):
+        """Stops flusher and writes all changed states"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            while await User.storage.flush():
+                pass
+            await User.storage.close()
+
+    async def run(self):
+        """Writes changed states forever"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await User.storage.flush()
+            except Exception:
+                logging.exception('Writing of user states failed')
+
+
+def init_state_storage(kind: str, capacity: int = 10000, redis_url: str = None) -> bool:
+    """
+    Sets User.storage
+    :param kind: 'sql' (users table), 'memory' (MemoryStateStorage) or 'redis' (RedisStateStorage)
+    :param capacity: max amount of users kept by MemoryStateStorage
+    :param redis_url: Redis url for RedisStateStorage
+    :return: True if storage is set, False if users table is used
+    """
+    if kind == 'memory':
+        User.storage = MemoryStateStorage(capacity)
+    elif kind == 'redis':
+        try:
+            User.storage = RedisStateStorage(redis_url)
+        except (ImportError, ValueError) as error:
+            logging.warning("Redis state storage is unavailable (%s: %s), using users table", error.__class__.__name__, error)
+            User.storage = None
+    else:
+        User.storage = None
+    logging.info("User states are kept in %s", User.storage.__class__.__name__ if User.storage else 'users table')
+    return User.storage is not None
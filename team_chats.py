@@ -0,0 +1,71 @@
+import asyncio
+import logging
+
+from models import Team
+
+
+class TeamChats:
+    """
+    Chat ids of all teams, so group messages are routed without reading teams table.
+    Set is loaded on start, updated by handlers that add or move teams and checked against database periodically
+    """
+
+    def __init__(self, check_interval: float = 600.0):
+        """:param check_interval: amount of seconds between checks against database"""
+        self.check_interval = check_interval
+        self.chats = set()
+        self._task: asyncio.Task = None
+
+    def __contains__(self, chat_id: int) -> bool:
+        return chat_id in self.chats
+
+    def add(self, chat_id: int):
+        """Adds chat of new team"""
+        self.chats.add(chat_id)
+
+    def move(self, chat_id: int, new_chat_id: int):
+        """Replaces chat id of team (when group migrates to supergroup)"""
+        self.chats.discard(chat_id)
+        self.chats.add(new_chat_id)
+
+    async def load(self) -> int:
+        """
+        Reads chat ids of all teams from database
+        :return: amount of chat ids that were different in set and in database
+        """
+        chats = {chat_id for chat_id, in await Team.aio.get_all_chats()}
+        difference = len(chats ^ self.chats)
+        self.chats = chats
+        return difference
+
+    async def start(self):
+        """Loads chat ids and starts checking them in background"""
+        if self._task is None:
+            await self.load()
+            logging.info('Loaded %s team chats', len(self.chats))
+            self._task = asyncio.get_event_loop().create_task(self.run())
+
+    async def stop(self):
+        """Stops background checks"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self):
+        """Checks set against database forever"""
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                difference = await self.load()
+            except Exception:
+                logging.exception('Team chats check failed')
+                continue
+            if difference:
+                logging.warning('%s team chats were out of sync with database', difference)
+
+
+team_chats = TeamChats()
@@ -0,0 +1,62 @@
+import re
+
+from aiogram.utils import markdown
+
+
+PLACEHOLDER = re.compile(r'%(\w+)%')
+LEGACY_MARKDOWN_SPECIAL = re.compile(r'([_*`\[])')  # characters that start entities in legacy Markdown
+
+
+def escape_legacy_markdown(value: str) -> str:
+    """Escapes value for legacy parse_mode='Markdown' (only _ * ` [ have to be escaped there)"""
+    return LEGACY_MARKDOWN_SPECIAL.sub(r'\\\1', value)
+
+
+ESCAPES = {  # {parse_mode of message: function that escapes inserted value}
+    None: str,
+    'HTML': markdown.quote_html,
+    'Markdown': escape_legacy_markdown,
+    'MarkdownV2': markdown.escape_md
+}
+
+
+class Markup(str):
+    """Value that is already formatted for parse_mode of message (like link built by bot), so it's inserted as is"""
+
+
+class Template:
+    """
+    String from answers.json with %placeholders% compiled into tokens once,
+    so rendering is one pass over tokens instead of a chain of str.replace
+    """
+
+    __slots__ = ('source', 'texts', 'names')
+
+    def __init__(self, source: str):
+        """:param source: string like '[%theme% #%id%]\n\n%text%'"""
+        tokens = PLACEHOLDER.split(source)
+        self.source = source
+        self.texts = tokens[0::2]  # text around placeholders, always one more than names
+        self.names = tokens[1::2]
+
+    def render(self, values: dict, parse_mode: str = None) -> str:
+        """
+        :param values: {placeholder name: value}, placeholders without value are kept as is
+        :param parse_mode: None, 'HTML', 'Markdown' or 'MarkdownV2', values (except Markup) are escaped for it
+        :return: string with placeholders replaced by values
+        :raise ValueError: if parse_mode is not supported
+        """
+        if parse_mode not in ESCAPES:
+            raise ValueError(f'Unsupported parse_mode {parse_mode!r}, expected one of {", ".join(map(repr, ESCAPES))}')
+        if not self.names:
+            return self.source
+        escape = ESCAPES[parse_mode]
+        parts = [self.texts[0]]
+        for name, text in zip(self.names, self.texts[1:]):
+            if name not in values:
+                parts.append(f'%{name}%')
+            else:
+                value = values[name]
+                parts.append(value if isinstance(value, Markup) else escape(str(value)))
+            parts.append(text)
+        return ''.join(parts)
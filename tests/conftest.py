@@ -0,0 +1,9 @@
+import pytest
+
+import database
+
+
+@pytest.fixture(scope='session')
+def database_ready(tmp_path_factory):
+    """Connects sync engine to temporary SQLite database (once, database.global_init can't be called again)"""
+    database.global_init(f"sqlite:///{tmp_path_factory.mktemp('database') / 'test.db'}")
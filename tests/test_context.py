@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+import aiogram.bot.api
+from aiogram import Bot, Dispatcher, types
+
+import filters
+from context import UpdateContext, UpdateContextMiddleware, UnitOfWorkMiddleware
+from models import User
+
+
+BOT_TOKEN = '123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'AXIOM'}
+
+
+async def make_request(session, server, token, method: str, data: dict = None, files: dict = None, **kwargs):
+    """Replies to Bot API requests instead of Telegram (same signature as aiogram.bot.api.make_request)"""
+    data = data or {}
+    return {'message_id': 1, 'date': int(time.time()), 'text': data.get('text', ''), 'from': BOT_USER, 'chat': {'id': data.get('chat_id'), 'type': 'private'}}
+
+
+def message(update_id: int, user_id: int, text: str, chat_id: int = None) -> types.Update:
+    sender = {'id': user_id, 'is_bot': False, 'first_name': 'Test'}
+    chat = {'id': user_id, 'type': 'private'} if chat_id is None else {'id': chat_id, 'type': 'supergroup', 'title': 'Group'}
+    return types.Update(update_id=update_id, message={'message_id': update_id, 'date': int(time.time()), 'text': text, 'from': sender, 'chat': chat})
+
+
+def button(update_id: int, user_id: int, data: str) -> types.Update:
+    sender = {'id': user_id, 'is_bot': False, 'first_name': 'Test'}
+    return types.Update(update_id=update_id, callback_query={'id': str(update_id), 'chat_instance': str(user_id), 'data': data, 'from': sender})
+
+
+def test_user_is_read_once_per_update(database_ready, monkeypatch):
+    """Middleware, filters and handler all ask for the user, but users table is read only once per update"""
+    monkeypatch.setattr(aiogram.bot.api, 'make_request', make_request)
+    User.add(401)
+    User.add(402, state='upload_menu')
+    User.add(403, state='faq')
+    contexts = []  # [(handler name, UpdateContext), ...]
+
+    async def scenario():
+        bot = Bot(BOT_TOKEN)
+        dp = Dispatcher(bot)
+        dp.middleware.setup(UpdateContextMiddleware())
+        dp.middleware.setup(UnitOfWorkMiddleware())
+
+        @dp.message_handler(filters.user_not_in_database)
+        async def new_user(message: types.Message, context: UpdateContext):
+            contexts.append(('new_user', context))
+            await message.answer('Hello')
+
+        @dp.message_handler(filters.is_group_chat)
+        async def group(message: types.Message, context: UpdateContext):
+            contexts.append(('group', context))
+            assert context.user.state == 'start'
+            assert (await context.load_user()).state == 'start'
+
+        @dp.message_handler(filters.in_upload_menu)
+        async def upload(message: types.Message, context: UpdateContext):
+            contexts.append(('upload', context))
+            await message.answer(context.user.state)
+
+        @dp.message_handler(lambda message: filters.is_faq_menu(UpdateContext.current(message.from_user.id).user.state))
+        async def faq(message: types.Message, context: UpdateContext):
+            contexts.append(('faq', context))
+            assert await filters.state_is(message, 'faq')
+            await message.answer(context.user.state)
+
+        @dp.callback_query_handler()
+        async def pressed(callback_query: types.CallbackQuery, context: UpdateContext):
+            contexts.append(('pressed', context))
+            assert await filters.user_state(callback_query) == 'start'
+            await callback_query.answer()
+
+        Bot.set_current(bot)
+        Dispatcher.set_current(dp)
+        await dp.process_updates([
+            message(1, 400, '/start'), message(2, 401, 'hi', chat_id=-100), message(3, 402, 'file'),
+            message(4, 403, 'question'), button(5, 401, '/leave')
+        ])
+        await (await bot.get_session()).close()
+
+    asyncio.run(scenario())
+    assert sorted(name for name, context in contexts) == ['faq', 'group', 'new_user', 'pressed', 'upload']
+    assert all(context.reads == 1 for name, context in contexts), [(name, context.reads) for name, context in contexts]
@@ -0,0 +1,25 @@
+import asyncio
+
+import aiohttp
+from aiogram.utils.exceptions import MessageNotModified, BotBlocked, RetryAfter
+
+from fan_out import FanOut
+
+
+def test_failed_call_does_not_stop_others():
+    async def raising(error: Exception):
+        raise error
+
+    async def done():
+        pass
+
+    calls = [
+        ('done', done),
+        ('unchanged', lambda: raising(MessageNotModified('Message is not modified'))),
+        ('missing', lambda: raising(BotBlocked('Forbidden: bot was blocked by the user'))),
+        ('telegram', lambda: raising(RetryAfter(5))),
+        ('network', lambda: raising(aiohttp.ClientConnectionError('Connection reset'))),
+        ('timeout', lambda: raising(asyncio.TimeoutError())),
+    ]
+    results = asyncio.run(FanOut(limit=2).run(calls, 'Test'))
+    assert results == {'done': 1, 'unchanged': 1, 'missing': 1, 'failed': 3}
@@ -0,0 +1,17 @@
+from answers import get_answers
+from router import StateRouter, MAX_UNKNOWN_STATES
+
+
+def test_unknown_states_are_not_kept_forever():
+    router = StateRouter()
+
+    async def cached_menu(message):
+        pass
+
+    router.register(lambda state: state.startswith('cached'), 'message', cached_menu)
+    for number in range(MAX_UNKNOWN_STATES * 3):
+        assert router.resolve(f'cached_{number}', 'message') is cached_menu
+        assert router.resolve(f'unknown_{number}', 'message') is None
+
+    assert router._unknown.cache_info().currsize == MAX_UNKNOWN_STATES
+    assert set(router._table) == set(get_answers().states)
@@ -0,0 +1,56 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from models import Timer
+from scheduler import Scheduler
+
+
+def stored(kind: str, key: str) -> Timer or None:
+    return next((timer for timer in Timer.get_due(1000) if (timer.kind, timer.key) == (kind, key)), None)
+
+
+def test_deadline_is_stored_and_pushed_without_microseconds(database_ready):
+    scheduler = Scheduler()
+    deadline = datetime.now() + timedelta(hours=1, microseconds=999999)
+    asyncio.run(scheduler.schedule('truncated', 1, deadline))
+
+    assert scheduler._deadlines[('truncated', '1')] == deadline.replace(microsecond=0)
+    assert ('truncated', '1', deadline.replace(microsecond=0)) in Timer.get_deadlines()
+
+
+def test_failed_callback_keeps_timer(database_ready):
+    calls = []
+
+    async def close(number: int):
+        calls.append(number)
+        if len(calls) == 1:
+            raise ConnectionError('Telegram is not available')
+
+    scheduler = Scheduler(retry_delay=60)
+    scheduler.register('flaky', close)
+    asyncio.run(scheduler.schedule('flaky', 1, datetime.now() - timedelta(seconds=1), number=1))
+
+    assert asyncio.run(scheduler.fire_due()) >= 1
+    assert stored('flaky', '1') is None  # postponed, so not due anymore
+    deadline = scheduler._deadlines[('flaky', '1')]
+    assert deadline > datetime.now() + timedelta(seconds=50)
+    assert ('flaky', '1', deadline) in Timer.get_deadlines()
+
+    Timer.set('flaky', '1', datetime.now().replace(microsecond=0) - timedelta(seconds=1), {'number': 1})
+    timer = stored('flaky', '1')
+    assert timer.attempts == 0  # moving deadline starts attempts again
+    asyncio.run(scheduler.fire(timer))
+    assert calls == [1, 1]
+    assert all((kind, key) != ('flaky', '1') for kind, key, deadline in Timer.get_deadlines())
+
+
+def test_only_fired_deadlines_leave_heap(database_ready):
+    scheduler = Scheduler()
+    now = datetime.now().replace(microsecond=0)
+    asyncio.run(scheduler.schedule('late', 1, now + timedelta(seconds=1)))
+    scheduler._push('late', '1', now - timedelta(seconds=1))  # heap is earlier than database (like rounded up TIMESTAMP)
+
+    scheduler._pop_handled()
+    assert scheduler._heap[0][1:] == ('late', '1')  # not fired, so kept
+    asyncio.run(scheduler._reload())
+    assert scheduler._deadlines[('late', '1')] == now + timedelta(seconds=1)
@@ -0,0 +1,27 @@
+import asyncio
+
+from send_queue import SendQueue, HIGH_PRIORITY
+
+
+def test_calls_to_one_chat_are_sent_one_at_a_time():
+    answered = []
+    sending = []
+
+    def call(number: int, duration: float):
+        async def send():
+            sending.append(number)
+            assert len(sending) == 1, f'{sending} are sent to the same chat at once'
+            await asyncio.sleep(duration)  # the first call is the slowest one
+            sending.remove(number)
+            answered.append(number)
+            return number
+        return send
+
+    async def scenario():
+        queue = SendQueue()
+        results = await asyncio.gather(*(queue.submit(42, HIGH_PRIORITY, call(number, 0.03 - number * 0.01)) for number in range(3)))
+        await queue.stop()
+        return results
+
+    assert asyncio.run(scenario()) == [0, 1, 2]
+    assert answered == [0, 1, 2]
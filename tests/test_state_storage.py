@@ -0,0 +1,89 @@
+import asyncio
+
+import fakeredis
+import pytest
+import redis.asyncio
+
+from models import User
+from state_storage import StateStorage, MemoryStateStorage, RedisStateStorage, UserNotFound
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    """Makes RedisStateStorage connect to in-memory fake Redis server"""
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.asyncio.Redis, 'from_url', classmethod(
+        lambda cls, url, **kwargs: fakeredis.FakeAsyncRedis(server=server, **kwargs)
+    ))
+    return server
+
+
+def test_storage_must_implement_all_methods():
+    class GetOnly(StateStorage):
+        async def get(self, user_id: int):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnly()
+
+
+def test_get_reads_users_table_only_once(database_ready, redis_server):
+    User.add(101)
+
+    async def scenario():
+        storage = RedisStateStorage('redis://localhost:6379/0')
+        first = await storage.get(101)
+        User.get(101).set(state='changed_in_table')
+        second = await storage.get(101)
+        missing = await storage.get(102)
+        await storage.close()
+        return first, second, missing
+
+    assert asyncio.run(scenario()) == (('start', None), ('start', None), None)
+
+
+def test_set_is_written_to_users_table_by_flush(database_ready, redis_server):
+    User.add(201)
+    User.add(202, state='registered')
+
+    async def scenario():
+        storage = RedisStateStorage('redis://localhost:6379/0')
+        assert await storage.set(201, state='question_menu') == ('question_menu', None)
+        assert await storage.set(201, cache='42') == ('question_menu', '42')
+        assert await storage.set(202, cache='7') == ('registered', '7')
+        assert User.read_state(201) == ('start', None)  # not written until flush
+
+        assert await storage.flush() == 2
+        assert await storage.flush() == 0
+        await storage.close()
+
+    asyncio.run(scenario())
+    assert User.read_state(201) == ('question_menu', '42')
+    assert User.read_state(202) == ('registered', '7')
+
+
+def test_forget_drops_changes(database_ready, redis_server):
+    User.add(301)
+
+    async def scenario():
+        storage = RedisStateStorage('redis://localhost:6379/0')
+        await storage.set(301, state='faq')
+        await storage.forget(301)
+        flushed = await storage.flush()
+        values = await storage.get(301)
+        await storage.close()
+        return flushed, values
+
+    assert asyncio.run(scenario()) == (0, ('start', None))
+
+
+def test_set_of_unknown_user_fails_clearly(database_ready, redis_server):
+    async def scenario(storage: StateStorage):
+        with pytest.raises(UserNotFound):
+            await storage.set(501, state='faq')
+        assert await storage.get(501) is None
+        assert await storage.flush() == 0
+        await storage.close()
+
+    asyncio.run(scenario(MemoryStateStorage()))
+    asyncio.run(scenario(RedisStateStorage('redis://localhost:6379/0')))
@@ -0,0 +1,17 @@
+import pytest
+
+from templates import Template, Markup
+
+
+def test_values_are_escaped_for_parse_mode():
+    template = Template('%name%: %link%')
+    values = {'name': 'snake_case *bold* <b>', 'link': Markup('[link](https://t.me)')}
+    assert template.render(values) == 'snake_case *bold* <b>: [link](https://t.me)'
+    assert template.render(values, 'HTML') == 'snake_case *bold* &lt;b&gt;: [link](https://t.me)'
+    assert template.render(values, 'Markdown') == 'snake\\_case \\*bold\\* <b>: [link](https://t.me)'
+    assert template.render(values, 'MarkdownV2') == 'snake\\_case \\*bold\\* <b\\>: [link](https://t.me)'
+
+
+def test_unsupported_parse_mode_is_named():
+    with pytest.raises(ValueError, match="'markdown'"):
+        Template('%name%').render({'name': 'Ivan'}, 'markdown')
@@ -0,0 +1,51 @@
+import json
+import os
+
+from watcher import WatchedFile, reload_files
+
+
+def write(path, data: dict, mtime_ns: int):
+    with open(path, 'w', encoding='UTF-8') as file:
+        json.dump(data, file)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_file_is_parsed_only_when_it_changes(tmp_path):
+    path = tmp_path / 'answers.json'
+    write(path, {'text': 'old'}, 1_000_000_000)
+    watched = WatchedFile(str(path), lambda raw, version: (raw['text'], version), check_interval=0)
+
+    for _ in range(100):
+        assert watched.get() == ('old', 1)
+    assert watched.loads == 1
+
+    write(path, {'text': 'new'}, 2_000_000_000)
+    for _ in range(100):
+        assert watched.get() == ('new', 2)
+    assert watched.loads == 2
+
+
+def test_broken_file_keeps_previous_snapshot(tmp_path):
+    path = tmp_path / 'config.json'
+    write(path, {'text': 'good'}, 1_000_000_000)
+    watched = WatchedFile(str(path), lambda raw, version: raw['text'], check_interval=0)
+    assert watched.get() == 'good'
+
+    path.write_text('{broken', encoding='UTF-8')
+    os.utime(path, ns=(2_000_000_000, 2_000_000_000))
+    assert watched.get() == 'good'
+    assert watched.get() == 'good'
+    assert watched.version == 1
+
+
+def test_forced_reload_reads_passed_files(tmp_path):
+    files = []
+    for name in ('config.json', 'answers.json'):
+        write(tmp_path / name, {'text': 'old'}, 1_000_000_000)
+        files.append(WatchedFile(str(tmp_path / name), lambda raw, version: raw['text'], check_interval=0))
+        assert files[-1].get() == 'old'
+        write(tmp_path / name, {'text': 'new'}, 1_000_000_000)  # same size and mtime, so change is not noticed
+
+    assert [watched.get() for watched in files] == ['old', 'old']
+    reload_files(*files)
+    assert [watched.get() for watched in files] == ['new', 'new']
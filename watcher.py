@@ -0,0 +1,91 @@
+import logging
+import json
+import os
+import signal
+import time
+
+
+logger = logging.getLogger(__name__)  # module functions like logging.info would configure root logger before setup_logging
+
+
+class WatchedFile:
+    """
+    JSON file that is parsed only when it changes on disk.
+    Every parse is compiled into a new snapshot which replaces the old one as a whole,
+    so readers always get either old or new data, never a mix of them
+    """
+
+    def __init__(self, path: str, compile_snapshot, check_interval: float = 1.0):
+        """
+        :param path: path to json file
+        :param compile_snapshot: function(raw: dict, version: int) that builds snapshot from parsed file
+        :param check_interval: minimal amount of seconds between two os.stat() calls
+        """
+        self.path = path
+        self.compile_snapshot = compile_snapshot
+        self.check_interval = check_interval
+        self.version = 0  # increases every time snapshot is replaced
+        self.loads = 0  # amount of json.load calls (for benchmarks)
+        self._snapshot = None
+        self._signature = None
+        self._checked_at = 0.0
+
+    def get(self):
+        """:return current snapshot (file is checked for changes at most once per check_interval)"""
+        now = time.monotonic()
+        if (self._snapshot is None) or (now - self._checked_at >= self.check_interval):
+            self._checked_at = now
+            self.check()
+        return self._snapshot
+
+    def check(self) -> bool:
+        """
+        Reloads file if its inode/mtime/size changed
+        :return: True if snapshot was replaced, False in any other case
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            if self._snapshot is None:
+                raise
+            logger.error('Can not access %s, using previous version', self.path)
+            return False
+        if (stat.st_ino, stat.st_mtime_ns, stat.st_size) == self._signature:
+            return False
+        return self.reload()
+
+    def reload(self) -> bool:
+        """
+        Parses file and replaces snapshot. Broken file is ignored while there is a previous snapshot
+        :return: True if snapshot was replaced, False in any other case
+        """
+        stat = os.stat(self.path)
+        self._signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        try:
+            with open(self.path, 'r', encoding='UTF-8') as file:
+                raw = json.load(file)
+            self.loads += 1
+            snapshot = self.compile_snapshot(raw, self.version + 1)
+        except (ValueError, KeyError, TypeError):
+            if self._snapshot is None:
+                raise
+            logger.exception('Failed to reload %s, using previous version', self.path)
+            return False
+
+        logger.info('Loaded %s (version %s)', self.path, self.version + 1)
+        self.version += 1
+        self._snapshot = snapshot
+        return True
+
+
+def reload_files(*files: WatchedFile):
+    """Forces reload of files"""
+    logger.info('Forced reload of %s', ', '.join(file.path for file in files))
+    for file in files:
+        file.reload()
+
+
+def reload_on_sighup(*files: WatchedFile):
+    """Makes SIGHUP reload files (does nothing on systems without SIGHUP)"""
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda *_: reload_files(*files))